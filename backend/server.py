@@ -1,38 +1,253 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query, Response
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, APIRouter, BackgroundTasks, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from bson import ObjectId
+from pymongo import ASCENDING, TEXT, IndexModel, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
 import os
+import asyncio
+import bisect
+import contextvars
 import logging
+import multiprocessing
+import threading
+import time
+import weakref
 import hashlib
 import json
+import re
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any, NamedTuple, Union
 import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from enum import Enum
 import qrcode
 import io
 import base64
 import csv
+import tempfile
+import zipfile
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
 from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Optional: only needed for a shared chain tail cache
+    aioredis = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics
+# Prometheus histograms kept in process and rendered at /metrics. Each request
+# collects (phase, seconds) pairs in a context variable; Motor copies the context
+# into its worker threads, so the command listener sees the same list.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+class MetricsRegistry:
+    """Labelled histograms and counters in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._histograms: Dict[str, tuple[str, tuple, tuple, Dict[tuple, Histogram]]] = {}
+        self._counters: Dict[str, tuple[str, tuple, Dict[tuple, float]]] = {}
+        # The Mongo listener observes from Motor's worker threads
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, help_text: str, labels: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self._histograms[name] = (help_text, labels, buckets, {})
+
+    def counter(self, name: str, help_text: str, labels: tuple):
+        self._counters[name] = (help_text, labels, {})
+
+    def observe(self, name: str, label_values: tuple, value: float):
+        _, _, buckets, series = self._histograms[name]
+        with self._lock:
+            histogram = series.get(label_values)
+            if histogram is None:
+                histogram = series[label_values] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, label_values: tuple, amount: float = 1):
+        series = self._counters[name][2]
+        with self._lock:
+            series[label_values] = series.get(label_values, 0) + amount
+
+    @staticmethod
+    def _labels(names: tuple, values: tuple, le: Optional[str] = None) -> str:
+        pairs = [
+            name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+            for name, value in zip(names, values)
+        ]
+        if le is not None:
+            pairs.append('le="' + le + '"')
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, (help_text, labels, buckets, series) in self._histograms.items():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for label_values, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{self._labels(labels, label_values, le)} {cumulative}")
+                    lines.append(f"{name}_sum{self._labels(labels, label_values)} {histogram.sum}")
+                    lines.append(f"{name}_count{self._labels(labels, label_values)} {cumulative}")
+            for name, (help_text, labels, series) in self._counters.items():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for label_values, value in series.items():
+                    lines.append(f"{name}{self._labels(labels, label_values)} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+metrics.histogram("http_request_duration_seconds", "Request latency by route", ("method", "route", "status"))
+metrics.histogram("request_phase_seconds", "Time spent per request in each internal phase", ("route", "phase"))
+metrics.histogram("mongo_commands_per_request", "MongoDB round trips per request", ("route",), COUNT_BUCKETS)
+metrics.histogram("mongo_command_duration_seconds", "MongoDB command latency", ("command",))
+metrics.counter("mongo_command_failures_total", "Failed MongoDB commands", ("command",))
+
+_request_phases: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("request_phases", default=None)
+
+def record_phase(phase: str, seconds: float):
+    phases = _request_phases.get()
+    if phases is not None:
+        phases.append((phase, seconds))
+
+class timed_phase:
+    """Context manager adding the elapsed time of its block to the current request's phase"""
+    __slots__ = ("phase", "started")
+
+    def __init__(self, phase: str):
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_phase(self.phase, time.perf_counter() - self.started)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        metrics.observe("mongo_command_duration_seconds", (event.command_name,), seconds)
+        record_phase("mongo", seconds)
+
+    def failed(self, event):
+        seconds = event.duration_micros / 1e6
+        metrics.observe("mongo_command_duration_seconds", (event.command_name,), seconds)
+        metrics.inc("mongo_command_failures_total", (event.command_name,))
+        record_phase("mongo", seconds)
+
+class MetricsMiddleware:
+    """Plain ASGI middleware (no BaseHTTPMiddleware task hop, streams pass straight through)"""
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths: Optional[Dict[Any, str]] = None
+
+    def route_path(self, scope) -> str:
+        # The router leaves the matched endpoint in the scope; label by its path
+        # template so per-batch URLs share one series
+        if self._route_paths is None:
+            self._route_paths = {route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")}
+        return self._route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        phases = []
+        token = _request_phases.set(phases)
+        status = 500
+        finished = False
+        
+        def finish():
+            nonlocal finished
+            finished = True
+            elapsed = time.perf_counter() - started
+            route = self.route_path(scope)
+            metrics.observe("http_request_duration_seconds", (scope["method"], route, status), elapsed)
+            totals: Dict[str, float] = {}
+            mongo_commands = 0
+            for phase, seconds in phases:
+                totals[phase] = totals.get(phase, 0.0) + seconds
+                mongo_commands += phase == "mongo"
+            for phase, seconds in totals.items():
+                metrics.observe("request_phase_seconds", (route, phase), seconds)
+            metrics.observe("mongo_commands_per_request", (route,), mongo_commands)
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            # Background tasks run after the last body chunk, still inside self.app;
+            # they are not part of the request's latency
+            if message["type"] == "http.response.body" and not message.get("more_body", False) and not finished:
+                finish()
+        
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_phases.reset(token)
+            if not finished:
+                finish()
+
+def create_background_task(coro) -> asyncio.Task:
+    """create_task for work that outlives the request that starts it.
+
+    Tasks copy the current context, which would otherwise carry the request's
+    phase list along and keep adding to it after the request is done.
+    """
+    context = contextvars.copy_context()
+    context.run(_request_phases.set, None)
+    return asyncio.create_task(coro, context=context)
+
+class TimedJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        with timed_phase("encode"):
+            return super().render(content)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url, tz_aware=True, event_listeners=[MongoCommandMetrics()] if METRICS_ENABLED else []
+)
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=TimedJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -190,7 +405,12 @@ class HerbBatch(BaseModel):
     created_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     current_status: str = "collected"
     qr_code: Optional[str] = None
-    blockchain_events: List[str] = Field(default_factory=list)  # List of event IDs
+    # Chain summary; block ids are looked up through the blockchain_events index
+    event_count: int = 0
+    tail_hash: str = "genesis"
+    last_block_number: int = 0
+    last_event_type: Optional[EventType] = None
+    last_event_at: Optional[datetime] = None
 
 # Request Models
 class CollectionEventCreate(BaseModel):
@@ -259,63 +479,520 @@ class RetailEventCreate(BaseModel):
     storage_conditions: Optional[str] = None
     notes: Optional[str] = None
 
+class BulkEventItem(BaseModel):
+    event_type: EventType
+    data: Dict[str, Any]  # Payload of the matching *EventCreate model, including batch_id
+    event_date: Optional[datetime] = None  # Original capture time for offline events
+
+class BulkEventsRequest(BaseModel):
+    events: List[BulkEventItem]
+
+class BatchSearchFilters(BaseModel):
+    herb_type: Optional[str] = None
+    status: Optional[str] = None
+    from_date: Optional[str] = None
+    to_date: Optional[str] = None
+    min_quantity: Optional[float] = None
+    max_quantity: Optional[float] = None
+    district: Optional[str] = None
+    state: Optional[str] = None
+    q: Optional[str] = None
+
+class LabelFormat(str, Enum):
+    PDF = "pdf"
+    ZIP = "zip"
+
+class QRLabelRequest(BaseModel):
+    batch_ids: Optional[List[str]] = None
+    filters: Optional[BatchSearchFilters] = None
+    format: LabelFormat = LabelFormat.PDF
+
+
+# Stage event registry
+# Adding a stage is one entry here: its POST /api/<event type> route, bulk
+# ingestion, storage and status transition are all driven by the spec
+class StageEventSpec(NamedTuple):
+    create_model: type
+    event_model: type
+    collection: str
+    date_field: str
+    status: Optional[str] = None
+    description: str = ""
+
+STAGE_EVENTS: Dict[EventType, StageEventSpec] = {
+    EventType.PROCESSING: StageEventSpec(
+        ProcessingEventCreate, ProcessingEvent, "processing_events", "processing_date",
+        description="Add a processing event to an existing batch"
+    ),
+    EventType.TESTING: StageEventSpec(
+        TestingEventCreate, TestingEvent, "testing_events", "testing_date",
+        description="Add a testing/lab results event to an existing batch"
+    ),
+    EventType.PACKAGING: StageEventSpec(
+        PackagingEventCreate, PackagingEvent, "packaging_events", "packaging_date", "packaged",
+        description="Add a packaging event to an existing batch"
+    ),
+    EventType.DISTRIBUTION: StageEventSpec(
+        DistributionEventCreate, DistributionEvent, "distribution_events", "distribution_date", "in_transit",
+        description="Add a distribution event to an existing batch"
+    ),
+    EventType.RETAIL: StageEventSpec(
+        RetailEventCreate, RetailEvent, "retail_events", "received_date", "retail_ready",
+        description="Add a retail event to an existing batch"
+    ),
+}
+
+BULK_EVENTS_MAX = int(os.environ.get('BULK_EVENTS_MAX', '5000'))
+
+# Every block already carries its full stage document in event_data; the
+# per-stage collections are a second copy that can be switched off
+WRITE_STAGE_COLLECTIONS = os.environ.get('WRITE_STAGE_COLLECTIONS', 'true').lower() in ('1', 'true', 'yes')
+
+
+# Caches
+class LRUCache:
+    """Size-bounded in-process LRU cache with optional TTL and hit/miss counters"""
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+class LocalChainTailBackend:
+    """In-process chain tail store; the default stand-in for a shared backend"""
+
+    def __init__(self, maxsize: int):
+        self._tails = LRUCache(maxsize)
+
+    async def get(self, batch_id: str) -> Optional[tuple[str, int]]:
+        return self._tails.get(batch_id)
+
+    async def set(self, batch_id: str, tail: tuple[str, int]):
+        self._tails.set(batch_id, tail)
+
+    async def delete(self, batch_id: str):
+        self._tails.pop(batch_id)
+
+    def describe(self) -> dict:
+        return {"backend": "local", "size": len(self._tails), "maxsize": self._tails.maxsize}
+
+class RedisChainTailBackend:
+    """Chain tails shared by every worker through Redis"""
+
+    def __init__(self, url: str, ttl_seconds: int):
+        self._redis = aioredis.from_url(url)
+        self._ttl = ttl_seconds
+
+    async def get(self, batch_id: str) -> Optional[tuple[str, int]]:
+        value = await self._redis.get(f"chain_tail:{batch_id}")
+        if value is None:
+            return None
+        block_number, tail_hash = value.decode().split(":", 1)
+        return tail_hash, int(block_number)
+
+    async def set(self, batch_id: str, tail: tuple[str, int]):
+        await self._redis.set(f"chain_tail:{batch_id}", f"{tail[1]}:{tail[0]}", ex=self._ttl)
+
+    async def delete(self, batch_id: str):
+        await self._redis.delete(f"chain_tail:{batch_id}")
+
+    def describe(self) -> dict:
+        return {"backend": "redis", "ttl_seconds": self._ttl}
+
+class ChainTailCache:
+    """Per-batch (hash, block_number) of the last block, kept in front of blockchain_events"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, batch_id: str) -> Optional[tuple[str, int]]:
+        tail = await self.backend.get(batch_id)
+        if tail is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return tail
+
+    async def set(self, batch_id: str, tail: tuple[str, int]):
+        await self.backend.set(batch_id, tail)
+
+    async def invalidate(self, batch_id: str):
+        await self.backend.delete(batch_id)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            **self.backend.describe(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+def create_chain_tail_cache() -> ChainTailCache:
+    """Use the shared Redis backend when configured, otherwise the in-process one"""
+    redis_url = os.environ.get('CHAIN_TAIL_REDIS_URL')
+    if redis_url:
+        if aioredis is None:
+            raise RuntimeError("CHAIN_TAIL_REDIS_URL is set but the redis package is not installed")
+        ttl_seconds = int(os.environ.get('CHAIN_TAIL_REDIS_TTL_SECONDS', '86400'))
+        return ChainTailCache(RedisChainTailBackend(redis_url, ttl_seconds))
+    return ChainTailCache(LocalChainTailBackend(int(os.environ.get('CHAIN_TAIL_CACHE_SIZE', '10000'))))
+
+chain_tail_cache = create_chain_tail_cache()
+
+class BatchLocks:
+    """Per-batch asyncio locks, so concurrent appends serialize per batch only"""
+
+    def __init__(self):
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def get(self, batch_id: str) -> asyncio.Lock:
+        lock = self._locks.get(batch_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[batch_id] = lock
+        return lock
+
+    @asynccontextmanager
+    async def hold(self, batch_ids):
+        # Acquire in sorted order so multi-batch holders cannot deadlock
+        locks = [self.get(batch_id) for batch_id in sorted(set(batch_ids))]
+        acquired = []
+        try:
+            for lock in locks:
+                await lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+batch_locks = BatchLocks()
+
+APPEND_MAX_RETRIES = int(os.environ.get('APPEND_MAX_RETRIES', '5'))
+
+# "on" writes blocks, stage documents and batch updates in one transaction (needs a
+# replica set or sharded cluster), "off" writes them one after another, "auto" asks the server
+MONGO_TRANSACTIONS = os.environ.get('MONGO_TRANSACTIONS', 'auto').lower()
+_transactions_supported: Optional[bool] = None
+
+async def transactions_enabled() -> bool:
+    global _transactions_supported
+    if MONGO_TRANSACTIONS in ('on', 'off'):
+        return MONGO_TRANSACTIONS == 'on'
+    if _transactions_supported is None:
+        try:
+            hello = await client.admin.command("hello")
+            _transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+        except Exception:
+            _transactions_supported = False
+    return _transactions_supported
+
 
 # Blockchain simulation functions
+# Canonical JSON used for block hashes: sorted keys and the default separators,
+# exactly what json.dumps(..., sort_keys=True) produces
+canonical_encoder = json.JSONEncoder(sort_keys=True)
+
+def to_document(model: BaseModel) -> dict:
+    """Dump a model once into the dict that is both hashed and stored, dates as ISO strings"""
+    with timed_phase("pydantic"):
+        return _isoformat_dates(model.dict())
+
+def _isoformat_dates(value):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if isinstance(item, datetime):
+                value[key] = item.isoformat()
+            elif isinstance(item, (dict, list)):
+                _isoformat_dates(item)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            if isinstance(item, datetime):
+                value[index] = item.isoformat()
+            elif isinstance(item, (dict, list)):
+                _isoformat_dates(item)
+    return value
+
+def hash_payload(event_data: dict, previous_hash: str, timestamp: str) -> bytes:
+    """Bytes hashed for a block, written out without building a wrapper dict"""
+    encode = canonical_encoder.encode
+    return (
+        f'{{"event_data": {encode(event_data)}, "previous_hash": {encode(previous_hash)}, '
+        f'"timestamp": {encode(timestamp)}}}'
+    ).encode()
+
 def calculate_hash(event_data: dict, previous_hash: str, timestamp: str) -> str:
     """Calculate hash for blockchain event"""
-    content = json.dumps({
-        "event_data": event_data,
-        "previous_hash": previous_hash,
-        "timestamp": timestamp
-    }, sort_keys=True)
-    return hashlib.sha256(content.encode()).hexdigest()
+    with timed_phase("hash"):
+        return hashlib.sha256(hash_payload(event_data, previous_hash, timestamp)).hexdigest()
 
 async def get_last_block_hash(batch_id: str) -> tuple[str, int]:
     """Get the hash and block number of the last event for a batch"""
+    tail = await chain_tail_cache.get(batch_id)
+    if tail is not None:
+        return tail
+
     last_event = await db.blockchain_events.find_one(
         {"batch_id": batch_id},
         sort=[("block_number", -1)]
     )
-    if last_event:
-        return last_event["hash"], last_event["block_number"]
-    return "genesis", 0
+    tail = (last_event["hash"], last_event["block_number"]) if last_event else ("genesis", 0)
+    await chain_tail_cache.set(batch_id, tail)
+    return tail
 
-async def create_blockchain_event(batch_id: str, event_type: EventType, event_data: dict) -> BlockchainEvent:
-    """Create a new blockchain event with proper hash chaining"""
-    previous_hash, last_block_number = await get_last_block_hash(batch_id)
-    
-    event = BlockchainEvent(
+def build_blockchain_event(batch_id: str, event_type: EventType, event_data: dict,
+                           previous_hash: str, last_block_number: int) -> BlockchainEvent:
+    """Build the next block on top of a known chain tail.
+
+    event_data must already be a stored document (see to_document); it is
+    hashed and stored as is, so the model is constructed without re-validation.
+    """
+    timestamp = datetime.now(timezone.utc)
+    return BlockchainEvent.model_construct(
+        id=str(uuid.uuid4()),
         batch_id=batch_id,
         event_type=event_type,
         event_data=event_data,
+        timestamp=timestamp,
         previous_hash=previous_hash,
+        hash=calculate_hash(event_data, previous_hash, timestamp.isoformat()),
         block_number=last_block_number + 1
     )
-    
-    # Calculate hash
-    event.hash = calculate_hash(
-        event_data,
-        previous_hash,
-        event.timestamp.isoformat()
-    )
-    
-    return event
+
+def block_document(event: BlockchainEvent) -> dict:
+    """Stored form of a block, without another dump of its event data"""
+    return {
+        "id": event.id,
+        "batch_id": event.batch_id,
+        "event_type": event.event_type,
+        "event_data": event.event_data,
+        "timestamp": event.timestamp.isoformat(),
+        "previous_hash": event.previous_hash,
+        "hash": event.hash,
+        "block_number": event.block_number
+    }
+
+async def create_blockchain_event(batch_id: str, event_type: EventType, event_data: dict) -> BlockchainEvent:
+    """Create a new blockchain event with proper hash chaining"""
+    previous_hash, last_block_number = await get_last_block_hash(batch_id)
+    return build_blockchain_event(batch_id, event_type, event_data, previous_hash, last_block_number)
+
+async def get_last_block_hashes(batch_ids: List[str]) -> Dict[str, tuple[str, int]]:
+    """Get the chain tail (hash, block number) of many batches in a single query"""
+    tails = {}
+    missing = []
+    for batch_id in batch_ids:
+        tail = await chain_tail_cache.get(batch_id)
+        if tail is None:
+            missing.append(batch_id)
+        else:
+            tails[batch_id] = tail
+    if not missing:
+        return tails
+
+    for batch_id in missing:
+        tails[batch_id] = ("genesis", 0)
+    pipeline = [
+        {"$match": {"batch_id": {"$in": missing}}},
+        {"$sort": {"batch_id": 1, "block_number": -1}},
+        {"$group": {
+            "_id": "$batch_id",
+            "hash": {"$first": "$hash"},
+            "block_number": {"$first": "$block_number"}
+        }}
+    ]
+    async for tail in db.blockchain_events.aggregate(pipeline):
+        tails[tail["_id"]] = (tail["hash"], tail["block_number"])
+    for batch_id in missing:
+        await chain_tail_cache.set(batch_id, tails[batch_id])
+    return tails
+
+def batch_summary(event: BlockchainEvent) -> dict:
+    """Chain summary stored on a batch once event is its newest block"""
+    return {
+        "event_count": event.block_number,
+        "tail_hash": event.hash,
+        "last_block_number": event.block_number,
+        "last_event_type": event.event_type,
+        "last_event_at": event.timestamp
+    }
+
+def batch_summary_operations(appended: Dict[str, List[BlockchainEvent]]) -> List[UpdateOne]:
+    """herb_batches updates that move batch summaries and search names forward"""
+    operations = []
+    for batch_id, events in appended.items():
+        if not events:
+            continue
+        # Never move a summary backwards if another process got further
+        operations.append(UpdateOne(
+            {"id": batch_id, "last_block_number": {"$not": {"$gte": events[-1].block_number}}},
+            {"$set": prepare_for_mongo(batch_summary(events[-1]))}
+        ))
+        names = sorted({name for event in events for name in search_names(event.event_data)})
+        if names:
+            operations.append(UpdateOne({"id": batch_id}, {"$addToSet": {"search.names": {"$each": names}}}))
+    return operations
+
+async def write_batch_summaries(appended: Dict[str, List[BlockchainEvent]], session=None):
+    """Default related writes of an append: only the batch summaries"""
+    operations = batch_summary_operations(appended)
+    if operations:
+        await db.herb_batches.bulk_write(operations, ordered=False, session=session)
+
+async def append_blockchain_events(
+    groups: Dict[str, List[tuple[EventType, dict]]],
+    write_related=write_batch_summaries
+) -> Dict[str, List[BlockchainEvent]]:
+    """Append events to many batch chains, in order, with one insert_many.
+
+    Appends are serialized per batch by an in-process lock, and the unique
+    (batch_id, block_number) index catches writers in other processes. A batch
+    that lost such a race has its tail re-read and the rest of its events
+    re-chained on top of it.
+
+    write_related(appended, session) makes the writes that belong with the new
+    blocks (stage documents, batch summaries and status). When transactions
+    are available they commit atomically with the blocks, and a lost race
+    retries the whole transaction; otherwise they follow the block insert.
+    """
+    appended: Dict[str, List[BlockchainEvent]] = {batch_id: [] for batch_id in groups}
+    use_transaction = await transactions_enabled()
+    async with batch_locks.hold(groups):
+        try:
+            pending = list(groups)
+            tails = await get_last_block_hashes(pending)
+            for attempt in range(APPEND_MAX_RETRIES):
+                built = []
+                for batch_id in pending:
+                    previous_hash, last_block_number = tails[batch_id]
+                    for event_type, event_data in groups[batch_id][len(appended[batch_id]):]:
+                        blockchain_event = build_blockchain_event(
+                            batch_id, event_type, event_data, previous_hash, last_block_number
+                        )
+                        previous_hash, last_block_number = blockchain_event.hash, blockchain_event.block_number
+                        built.append(blockchain_event)
+
+                try:
+                    if use_transaction:
+                        async with await client.start_session() as session:
+                            async with session.start_transaction():
+                                await db.blockchain_events.insert_many(
+                                    [block_document(blockchain_event) for blockchain_event in built],
+                                    ordered=True, session=session
+                                )
+                                chained: Dict[str, List[BlockchainEvent]] = {batch_id: [] for batch_id in groups}
+                                for blockchain_event in built:
+                                    chained[blockchain_event.batch_id].append(blockchain_event)
+                                await write_related(chained, session)
+                    else:
+                        await db.blockchain_events.insert_many(
+                            [block_document(blockchain_event) for blockchain_event in built],
+                            ordered=True
+                        )
+                    inserted = len(built)
+                except BulkWriteError as e:
+                    if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                        raise
+                    # An aborted transaction keeps nothing; otherwise the blocks before the conflict stay
+                    conflicted = built[e.details.get("nInserted", 0)].batch_id
+                    inserted = 0 if use_transaction else e.details.get("nInserted", 0)
+                except PyMongoError as e:
+                    if not (use_transaction and e.has_error_label("TransientTransactionError")):
+                        raise
+                    logger.warning(f"Transient transaction error appending blocks, retrying (attempt {attempt + 1}): {e}")
+                    continue
+
+                for blockchain_event in built[:inserted]:
+                    appended[blockchain_event.batch_id].append(blockchain_event)
+                    tails[blockchain_event.batch_id] = (blockchain_event.hash, blockchain_event.block_number)
+                if inserted == len(built):
+                    break
+
+                # Another writer took this block number: re-read the tail and retry from there
+                if not use_transaction:
+                    pending = pending[pending.index(conflicted):]
+                await chain_tail_cache.invalidate(conflicted)
+                tails[conflicted] = await get_last_block_hash(conflicted)
+                logger.warning(f"Block number conflict on batch {conflicted}, retrying (attempt {attempt + 1})")
+            else:
+                raise RuntimeError(f"Could not append blocks after {APPEND_MAX_RETRIES} attempts")
+
+            if not use_transaction:
+                await write_related(appended, None)
+        except Exception:
+            for batch_id in groups:
+                await chain_tail_cache.invalidate(batch_id)
+            raise
+
+        for batch_id, events in appended.items():
+            if events:
+                await chain_tail_cache.set(batch_id, tails[batch_id])
+    return appended
 
 # Helper functions
+# "string" stores dates as ISO strings (the original format); "native" stores BSON
+# datetimes. Blocks are hashed over ISO strings, so blockchain_events keep strings
+# in both modes. While collections are being migrated, DATE_DUAL_READ makes date
+# queries match both representations.
+DATE_STORAGE_MODE = os.environ.get('DATE_STORAGE_MODE', 'string')
+DATE_DUAL_READ = os.environ.get('DATE_DUAL_READ', 'true').lower() in ('1', 'true', 'yes')
+DATE_MIGRATION_BATCH = int(os.environ.get('DATE_MIGRATION_BATCH', '1000'))
+DATE_FIELDS = (
+    'timestamp', 'collection_date', 'processing_date', 'testing_date', 'created_date', 'test_date',
+    'packaging_date', 'expiry_date', 'distribution_date', 'expected_delivery', 'received_date',
+    'last_event_at'
+)
+
 def prepare_for_mongo(data: dict) -> dict:
     """Prepare data for MongoDB storage"""
-    if isinstance(data.get('timestamp'), datetime):
-        data['timestamp'] = data['timestamp'].isoformat()
-    if isinstance(data.get('collection_date'), datetime):
-        data['collection_date'] = data['collection_date'].isoformat()
-    if isinstance(data.get('processing_date'), datetime):
-        data['processing_date'] = data['processing_date'].isoformat()
-    if isinstance(data.get('testing_date'), datetime):
-        data['testing_date'] = data['testing_date'].isoformat()
-    if isinstance(data.get('created_date'), datetime):
-        data['created_date'] = data['created_date'].isoformat()
-    if isinstance(data.get('test_date'), datetime):
-        data['test_date'] = data['test_date'].isoformat()
+    if DATE_STORAGE_MODE == 'native':
+        return data
+    for field in DATE_FIELDS:
+        if isinstance(data.get(field), datetime):
+            data[field] = data[field].isoformat()
     
     # Handle nested test_results
     if 'test_results' in data and isinstance(data['test_results'], list):
@@ -326,396 +1003,2461 @@ def prepare_for_mongo(data: dict) -> dict:
     return data
 
 def parse_from_mongo(item: dict) -> dict:
-    """Parse data from MongoDB"""
-    if isinstance(item.get('timestamp'), str):
-        item['timestamp'] = datetime.fromisoformat(item['timestamp'])
-    if isinstance(item.get('collection_date'), str):
-        item['collection_date'] = datetime.fromisoformat(item['collection_date'])
-    if isinstance(item.get('processing_date'), str):
-        item['processing_date'] = datetime.fromisoformat(item['processing_date'])
-    if isinstance(item.get('testing_date'), str):
-        item['testing_date'] = datetime.fromisoformat(item['testing_date'])
-    if isinstance(item.get('created_date'), str):
-        item['created_date'] = datetime.fromisoformat(item['created_date'])
-    if isinstance(item.get('test_date'), str):
-        item['test_date'] = datetime.fromisoformat(item['test_date'])
+    """Parse data from MongoDB; native datetimes pass through untouched"""
+    for field in DATE_FIELDS:
+        if isinstance(item.get(field), str):
+            item[field] = datetime.fromisoformat(item[field])
     return item
 
-# API Routes
-@api_router.get("/")
-async def root():
-    return {"message": "Ayurvedic Herb Traceability Platform API"}
+def parse_date(value: str) -> datetime:
+    """Parse a query date; naive values are taken as UTC"""
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
 
-@api_router.post("/collection")
-async def create_collection_event(input: CollectionEventCreate):
-    """Record a new herb collection event and create a batch"""
-    try:
-        # Create collection event
-        collection_event = CollectionEvent(**input.dict())
-        
-        # Create herb batch
-        batch_number = f"BATCH-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8].upper()}"
-        herb_batch = HerbBatch(
-            batch_number=batch_number,
-            herb_type=input.herb_type,
-            total_quantity_kg=input.quantity_kg,
-            origin_location=input.location
-        )
-        
-        # Create blockchain event with serialized data
-        collection_data = prepare_for_mongo(collection_event.dict())
-        blockchain_event = await create_blockchain_event(
-            herb_batch.id,
-            EventType.COLLECTION,
-            collection_data
-        )
-        
-        # Store in MongoDB
-        collection_dict = prepare_for_mongo(collection_event.dict())
-        await db.collection_events.insert_one(collection_dict)
-        
-        blockchain_dict = prepare_for_mongo(blockchain_event.dict())
-        await db.blockchain_events.insert_one(blockchain_dict)
-        
-        herb_batch.blockchain_events.append(blockchain_event.id)
-        batch_dict = prepare_for_mongo(herb_batch.dict())
-        await db.herb_batches.insert_one(batch_dict)
-        
-        # Return the batch with properly serialized data using jsonable_encoder
-        return jsonable_encoder(herb_batch)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+def _convert_dates(doc: dict, convert) -> dict:
+    """Copy of a document with its date fields (and nested test dates) converted"""
+    converted = dict(doc)
+    for field in DATE_FIELDS:
+        if field in converted and converted[field] is not None:
+            converted[field] = convert(converted[field])
+    if isinstance(converted.get('test_results'), list):
+        converted['test_results'] = [
+            _convert_dates(test_result, convert) if isinstance(test_result, dict) else test_result
+            for test_result in converted['test_results']
+        ]
+    return converted
 
-@api_router.post("/processing")
-async def add_processing_event(input: ProcessingEventCreate):
-    """Add a processing event to an existing batch"""
-    try:
-        # Check if batch exists
-        batch = await db.herb_batches.find_one({"id": input.batch_id})
-        if not batch:
-            raise HTTPException(status_code=404, detail="Batch not found")
-        
-        # Create processing event
-        processing_event = ProcessingEvent(**input.dict(exclude={"batch_id"}))
-        
-        # Create blockchain event with serialized data
-        processing_data = prepare_for_mongo(processing_event.dict())
-        blockchain_event = await create_blockchain_event(
-            input.batch_id,
-            EventType.PROCESSING,
-            processing_data
-        )
-        
-        # Store in MongoDB
-        processing_dict = prepare_for_mongo(processing_event.dict())
-        await db.processing_events.insert_one(processing_dict)
-        
-        blockchain_dict = prepare_for_mongo(blockchain_event.dict())
-        await db.blockchain_events.insert_one(blockchain_dict)
-        
-        # Update batch
-        await db.herb_batches.update_one(
-            {"id": input.batch_id},
-            {"$push": {"blockchain_events": blockchain_event.id}}
-        )
-        
-        return {"message": "Processing event added successfully", "event_id": processing_event.id}
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+def _to_native(value):
+    return parse_date(value) if isinstance(value, str) else value
 
-@api_router.post("/testing")
-async def add_testing_event(input: TestingEventCreate):
-    """Add a testing/lab results event to an existing batch"""
-    try:
-        # Check if batch exists
-        batch = await db.herb_batches.find_one({"id": input.batch_id})
-        if not batch:
-            raise HTTPException(status_code=404, detail="Batch not found")
-        
-        # Create testing event
-        testing_event = TestingEvent(**input.dict(exclude={"batch_id"}))
-        
-        # Create blockchain event with serialized data
-        testing_data = prepare_for_mongo(testing_event.dict())
-        blockchain_event = await create_blockchain_event(
-            input.batch_id,
-            EventType.TESTING,
-            testing_data
-        )
-        
-        # Store in MongoDB
-        testing_dict = prepare_for_mongo(testing_event.dict())
-        await db.testing_events.insert_one(testing_dict)
-        
-        blockchain_dict = prepare_for_mongo(blockchain_event.dict())
-        await db.blockchain_events.insert_one(blockchain_dict)
-        
-        # Update batch
-        await db.herb_batches.update_one(
-            {"id": input.batch_id},
-            {"$push": {"blockchain_events": blockchain_event.id}}
-        )
-        
-        return {"message": "Testing event added successfully", "event_id": testing_event.id}
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+def _to_string(value):
+    return value.isoformat() if isinstance(value, datetime) else value
 
-@api_router.post("/packaging")
-async def add_packaging_event(input: PackagingEventCreate):
-    """Add a packaging event to an existing batch"""
-    try:
-        # Check if batch exists
-        batch = await db.herb_batches.find_one({"id": input.batch_id})
-        if not batch:
-            raise HTTPException(status_code=404, detail="Batch not found")
-        
-        # Create packaging event
-        packaging_event = PackagingEvent(**input.dict(exclude={"batch_id"}))
-        
-        # Create blockchain event with serialized data
-        packaging_data = prepare_for_mongo(packaging_event.dict())
-        blockchain_event = await create_blockchain_event(
-            input.batch_id,
-            EventType.PACKAGING,
-            packaging_data
-        )
-        
-        # Store in MongoDB
-        packaging_dict = prepare_for_mongo(packaging_event.dict())
-        await db.packaging_events.insert_one(packaging_dict)
-        
-        blockchain_dict = prepare_for_mongo(blockchain_event.dict())
-        await db.blockchain_events.insert_one(blockchain_dict)
-        
-        # Update batch status
-        await db.herb_batches.update_one(
-            {"id": input.batch_id},
-            {
-                "$push": {"blockchain_events": blockchain_event.id},
-                "$set": {"current_status": "packaged"}
-            }
-        )
-        
-        return {"message": "Packaging event added successfully", "event_id": packaging_event.id}
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+def storage_document(event_data: dict) -> dict:
+    """Stage document to store for an event whose hashed form is event_data"""
+    if DATE_STORAGE_MODE == 'native':
+        return _convert_dates(event_data, _to_native)
+    # A copy: inserting adds _id, and event_data must stay exactly what was hashed
+    return dict(event_data)
 
-@api_router.post("/distribution")
-async def add_distribution_event(input: DistributionEventCreate):
-    """Add a distribution event to an existing batch"""
-    try:
-        # Check if batch exists
-        batch = await db.herb_batches.find_one({"id": input.batch_id})
-        if not batch:
-            raise HTTPException(status_code=404, detail="Batch not found")
-        
-        # Create distribution event
-        distribution_event = DistributionEvent(**input.dict(exclude={"batch_id"}))
-        
-        # Create blockchain event with serialized data
-        distribution_data = prepare_for_mongo(distribution_event.dict())
-        blockchain_event = await create_blockchain_event(
-            input.batch_id,
-            EventType.DISTRIBUTION,
-            distribution_data
-        )
-        
-        # Store in MongoDB
-        distribution_dict = prepare_for_mongo(distribution_event.dict())
-        await db.distribution_events.insert_one(distribution_dict)
-        
-        blockchain_dict = prepare_for_mongo(blockchain_event.dict())
-        await db.blockchain_events.insert_one(blockchain_dict)
-        
-        # Update batch status
-        await db.herb_batches.update_one(
-            {"id": input.batch_id},
-            {
-                "$push": {"blockchain_events": blockchain_event.id},
-                "$set": {"current_status": "in_transit"}
-            }
-        )
-        
-        return {"message": "Distribution event added successfully", "event_id": distribution_event.id}
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+def date_range_query(field: str, from_date: Optional[str], to_date: Optional[str]) -> dict:
+    """Range filter on a date field that can use its index in either storage mode"""
+    string_range = {}
+    if from_date:
+        string_range["$gte"] = from_date
+    if to_date:
+        string_range["$lte"] = to_date
+    if DATE_STORAGE_MODE != 'native':
+        return {field: string_range}
+    
+    native_range = {}
+    if from_date:
+        native_range["$gte"] = parse_date(from_date)
+    if to_date:
+        native_range["$lte"] = parse_date(to_date)
+    if not DATE_DUAL_READ:
+        return {field: native_range}
+    # Range operators only match values of the same BSON type, so each branch is its own index scan
+    return {"$or": [{field: native_range}, {field: string_range}]}
 
-@api_router.post("/retail")
-async def add_retail_event(input: RetailEventCreate):
-    """Add a retail event to an existing batch"""
-    try:
-        # Check if batch exists
-        batch = await db.herb_batches.find_one({"id": input.batch_id})
-        if not batch:
-            raise HTTPException(status_code=404, detail="Batch not found")
-        
-        # Create retail event
-        retail_event = RetailEvent(**input.dict(exclude={"batch_id"}))
-        
-        # Create blockchain event with serialized data
-        retail_data = prepare_for_mongo(retail_event.dict())
-        blockchain_event = await create_blockchain_event(
-            input.batch_id,
-            EventType.RETAIL,
-            retail_data
-        )
-        
-        # Store in MongoDB
-        retail_dict = prepare_for_mongo(retail_event.dict())
-        await db.retail_events.insert_one(retail_dict)
-        
-        blockchain_dict = prepare_for_mongo(blockchain_event.dict())
-        await db.blockchain_events.insert_one(blockchain_dict)
-        
-        # Update batch status
-        await db.herb_batches.update_one(
-            {"id": input.batch_id},
-            {
-                "$push": {"blockchain_events": blockchain_event.id},
-                "$set": {"current_status": "retail_ready"}
-            }
-        )
-        
-        return {"message": "Retail event added successfully", "event_id": retail_event.id}
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+SEARCH_BACKFILL_BATCH = int(os.environ.get('SEARCH_BACKFILL_BATCH', '500'))
 
+async def backfill_batch_search(rebuild: bool = False) -> int:
+    """Fill in the search fields of batches created before they existed.
 
-@api_router.get("/batch/{batch_id}")
-async def get_batch(batch_id: str):
-    """Get batch details"""
-    batch = await db.herb_batches.find_one({"id": batch_id}, {"_id": 0})
-    if not batch:
-        raise HTTPException(status_code=404, detail="Batch not found")
-    
-    batch = parse_from_mongo(batch)
-    return jsonable_encoder(HerbBatch(**batch))
+    Names are gathered from each batch's blocks. With rebuild, every batch is
+    recomputed (for example after changing the normalization).
+    """
+    updated = 0
+    base = {} if rebuild else {"search": {"$exists": False}}
+    query = base
+    name_fields = {f"event_data.{field}": 1 for field in SEARCH_NAME_FIELDS}
+    while True:
+        batches = await db.herb_batches.find(query, {"_id": 1, "id": 1, "origin_location": 1}).sort("_id", 1).limit(SEARCH_BACKFILL_BATCH).to_list(SEARCH_BACKFILL_BATCH)
+        if not batches:
+            return updated
+        names: Dict[str, set] = {batch["id"]: set() for batch in batches}
+        async for block in db.blockchain_events.find(
+            {"batch_id": {"$in": list(names)}},
+            {"_id": 0, "batch_id": 1, "event_data.test_results.lab_name": 1, **name_fields}
+        ):
+            names[block["batch_id"]].update(search_names(block.get("event_data") or {}))
+        result = await db.herb_batches.bulk_write([
+            UpdateOne({"_id": batch["_id"]}, {"$set": {"search": batch_search_fields(batch.get("origin_location"), sorted(names[batch["id"]]))}})
+            for batch in batches
+        ], ordered=False)
+        updated += result.modified_count
+        query = {**base, "_id": {"$gt": batches[-1]["_id"]}}
 
-@api_router.get("/batch/{batch_id}/provenance")
-async def get_batch_provenance(batch_id: str):
-    """Get complete provenance chain for a batch"""
-    try:
-        # Get batch
-        batch = await db.herb_batches.find_one({"id": batch_id}, {"_id": 0})
-        if not batch:
-            raise HTTPException(status_code=404, detail="Batch not found")
-        
-        # Get all blockchain events for this batch
-        events = await db.blockchain_events.find(
-            {"batch_id": batch_id},
-            {"_id": 0}  # Exclude MongoDB _id field
-        ).sort("block_number", 1).to_list(length=None)
-        
-        # Parse events
-        parsed_events = [parse_from_mongo(event) for event in events]
-        
-        # Verify blockchain integrity
-        for i, event in enumerate(parsed_events):
-            if i == 0:
-                expected_previous_hash = "genesis"
-            else:
-                expected_previous_hash = parsed_events[i-1]["hash"]
-            
-            if event["previous_hash"] != expected_previous_hash:
-                raise HTTPException(status_code=400, detail=f"Blockchain integrity compromised at block {event['block_number']}")
-        
-        result = {
-            "batch": parse_from_mongo(batch),
-            "provenance_chain": parsed_events,
-            "chain_verified": True,
-            "total_events": len(parsed_events)
+SUMMARY_MIGRATION_BATCH = int(os.environ.get('SUMMARY_MIGRATION_BATCH', '500'))
+
+async def chain_summaries(batch_ids: List[str]) -> Dict[str, dict]:
+    """Chain summaries of batches read from their stored last blocks"""
+    tails = await db.blockchain_events.aggregate([
+        {"$match": {"batch_id": {"$in": batch_ids}}},
+        {"$sort": {"batch_id": 1, "block_number": -1}},
+        {"$group": {"_id": "$batch_id", "block": {"$first": {
+            "hash": "$hash", "block_number": "$block_number", "event_type": "$event_type", "timestamp": "$timestamp"
+        }}}}
+    ]).to_list(None)
+    last_blocks = {tail["_id"]: tail["block"] for tail in tails}
+    summaries = {}
+    for batch_id in batch_ids:
+        block = last_blocks.get(batch_id)
+        summary = {
+            "event_count": block["block_number"] if block else 0,
+            "tail_hash": block["hash"] if block else "genesis",
+            "last_block_number": block["block_number"] if block else 0,
+            "last_event_type": block["event_type"] if block else None,
+            "last_event_at": block["timestamp"] if block else None,
         }
-        return jsonable_encoder(result)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        if DATE_STORAGE_MODE == 'native':
+            summary = _convert_dates(summary, _to_native)
+        summaries[batch_id] = summary
+    return summaries
 
-@api_router.get("/batches")
-async def get_all_batches():
-    """Get all herb batches"""
-    batches = await db.herb_batches.find({}, {"_id": 0}).to_list(1000)
-    parsed_batches = [parse_from_mongo(batch) for batch in batches]
-    return jsonable_encoder([HerbBatch(**batch) for batch in parsed_batches])
+async def migrate_batch_summaries() -> int:
+    """Replace the block id arrays of older batches with a chain summary, in batches.
 
-@api_router.get("/qr/{batch_id}")
-async def generate_qr_info(batch_id: str):
-    """Generate QR code information for a batch"""
-    batch = await db.herb_batches.find_one({"id": batch_id}, {"_id": 0})
-    if not batch:
-        raise HTTPException(status_code=404, detail="Batch not found")
-    
-    # QR code data
-    qr_data = {
-        "batch_id": batch_id,
-        "batch_number": batch["batch_number"],
-        "herb_type": batch["herb_type"],
-        "scan_url": f"/scan/{batch_id}",
-        "verification_hash": hashlib.sha256(f"{batch_id}{batch['batch_number']}".encode()).hexdigest()[:16]
+    Each batch's summary is read from its last block; the $unset and $set only
+    apply while the array is still there, so the migration can be rerun.
+    """
+    migrated = 0
+    query = {"blockchain_events": {"$exists": True}}
+    while True:
+        batches = await db.herb_batches.find(query, {"_id": 1, "id": 1}).sort("_id", 1).limit(SUMMARY_MIGRATION_BATCH).to_list(SUMMARY_MIGRATION_BATCH)
+        if not batches:
+            return migrated
+        batch_ids = [batch["id"] for batch in batches]
+        query = {"blockchain_events": {"$exists": True}, "_id": {"$gt": batches[-1]["_id"]}}
+        summaries = await chain_summaries(batch_ids)
+        operations = [
+            UpdateOne(
+                {"id": batch_id, "blockchain_events": {"$exists": True}},
+                {"$set": summary, "$unset": {"blockchain_events": ""}}
+            )
+            for batch_id, summary in summaries.items()
+        ]
+        result = await db.herb_batches.bulk_write(operations, ordered=False)
+        migrated += result.modified_count
+
+DATE_MIGRATION_COLLECTIONS = ["herb_batches", "collection_events"] + [spec.collection for spec in STAGE_EVENTS.values()]
+
+async def migrate_dates(collection_name: str, target: str = 'native') -> int:
+    """Convert the date fields of one collection to target ("native" or "string") in batches.
+
+    Walks the collection in _id order and only rewrites documents still holding
+    the other representation, so it can be stopped and rerun safely.
+    """
+    source_type, convert = ("string", _to_native) if target == 'native' else ("date", _to_string)
+    collection = db[collection_name]
+    pending = {"$or": [{field: {"$type": source_type}} for field in DATE_FIELDS] + [
+        {"test_results.test_date": {"$type": source_type}}
+    ]}
+    converted = 0
+    last_id = None
+    while True:
+        query = pending if last_id is None else {"$and": [pending, {"_id": {"$gt": last_id}}]}
+        docs = await collection.find(query).sort("_id", 1).limit(DATE_MIGRATION_BATCH).to_list(DATE_MIGRATION_BATCH)
+        if not docs:
+            return converted
+        operations = []
+        for doc in docs:
+            updated = _convert_dates(doc, convert)
+            changes = {key: value for key, value in updated.items() if value != doc.get(key)}
+            if changes:
+                # Only overwrite fields that still hold the value that was read
+                operations.append(UpdateOne(
+                    {"_id": doc["_id"], **{key: doc[key] for key in changes}},
+                    {"$set": changes}
+                ))
+        if operations:
+            result = await collection.bulk_write(operations, ordered=False)
+            converted += result.modified_count
+        last_id = docs[-1]["_id"]
+
+# Batch listings
+BATCH_PAGE_DEFAULT = int(os.environ.get('BATCH_PAGE_DEFAULT', '100'))
+BATCH_PAGE_MAX = int(os.environ.get('BATCH_PAGE_MAX', '1000'))
+
+# Searchable copies kept on each batch under "search": lowercased location
+# names for indexed exact/prefix matching, and the names of everyone who
+# handled the batch for the text index
+SEARCH_NAME_FIELDS = ("collector_name", "processor_name", "lab_name", "packager_name", "distributor_name", "retailer_name")
+
+def normalize_search_text(value) -> str:
+    return " ".join(str(value).split()).casefold() if value is not None else ""
+
+def search_names(event_data: dict) -> List[str]:
+    """Names in a stage document that batches can be found by"""
+    names = [event_data.get(field) for field in SEARCH_NAME_FIELDS]
+    names += [test.get("lab_name") for test in event_data.get("test_results") or [] if isinstance(test, dict)]
+    return sorted({name.strip() for name in names if isinstance(name, str) and name.strip()})
+
+def batch_search_fields(location: Optional[dict], names: List[str]) -> dict:
+    location = location or {}
+    return {
+        "district": normalize_search_text(location.get("district")),
+        "state": normalize_search_text(location.get("state")),
+        "names": names
     }
-    
-    return qr_data
 
+def build_batch_search_query(
+    herb_type: Optional[str] = None,
+    status: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    min_quantity: Optional[float] = None,
+    max_quantity: Optional[float] = None,
+    district: Optional[str] = None,
+    state: Optional[str] = None,
+    q: Optional[str] = None,
+) -> dict:
+    """Build the herb_batches filter shared by search, listings and exports.
 
-@api_router.get("/qr/{batch_id}/image")
-async def generate_qr_image(batch_id: str):
-    """Generate actual QR code image for a batch"""
+    district and state match the start of the normalized name (so an exact
+    name matches too); q is a text search over batch numbers and handler names.
+    """
+    query = {}
+    
+    if q:
+        query["$text"] = {"$search": q}
+    
+    if herb_type:
+        query["herb_type"] = herb_type
+    
+    if status:
+        query["current_status"] = status
+    
+    if from_date or to_date:
+        query.update(date_range_query("created_date", from_date, to_date))
+    
+    if min_quantity is not None or max_quantity is not None:
+        quantity_query = {}
+        if min_quantity is not None:
+            quantity_query["$gte"] = min_quantity
+        if max_quantity is not None:
+            quantity_query["$lte"] = max_quantity
+        if quantity_query:
+            query["total_quantity_kg"] = quantity_query
+    
+    # Anchored, case-sensitive prefixes on normalized values are index range scans
+    if district:
+        query["search.district"] = {"$regex": "^" + re.escape(normalize_search_text(district))}
+    
+    if state:
+        query["search.state"] = {"$regex": "^" + re.escape(normalize_search_text(state))}
+    
+    return query
+
+def encode_cursor(object_id: ObjectId) -> str:
+    return base64.urlsafe_b64encode(object_id.binary).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> ObjectId:
     try:
-        batch = await db.herb_batches.find_one({"id": batch_id}, {"_id": 0})
+        return ObjectId(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def batch_projection(fields: Optional[str]) -> Optional[dict]:
+    """Turn a comma separated fields= parameter into a Mongo projection"""
+    if not fields:
+        # blockchain_events is left on batches that predate migrate-batch-summaries
+        return {"blockchain_events": 0, "search": 0}
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(HerbBatch.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return {"_id": 1, "id": 1, **{field: 1 for field in requested}}
+
+async def find_batch_page(query: dict, limit: int, cursor: Optional[str], fields: Optional[str]) -> tuple[List[dict], Optional[str]]:
+    """Fetch one page of batches, newest first, keyed on _id.
+
+    Text searches return the best `limit` matches by relevance instead, with
+    their score, and have no further pages.
+    """
+    if "$text" in query:
+        if cursor:
+            raise HTTPException(status_code=400, detail="cursor cannot be combined with a text search")
+        projection = {**batch_projection(fields), "score": {"$meta": "textScore"}}
+        batches = await db.herb_batches.find(query, projection).sort(
+            [("score", {"$meta": "textScore"}), ("_id", -1)]
+        ).limit(limit).to_list(limit)
+        for batch in batches:
+            batch.pop("_id", None)
+        return batches, None
+    if cursor:
+        query = {"$and": [query, {"_id": {"$lt": decode_cursor(cursor)}}]} if query else {"_id": {"$lt": decode_cursor(cursor)}}
+    batches = await db.herb_batches.find(query, batch_projection(fields)).sort("_id", -1).limit(limit + 1).to_list(limit + 1)
+    next_cursor = encode_cursor(batches[limit - 1]["_id"]) if len(batches) > limit else None
+    batches = batches[:limit]
+    for batch in batches:
+        batch.pop("_id", None)
+    return batches, next_cursor
+
+CSV_EXPORT_CHUNK_ROWS = int(os.environ.get('CSV_EXPORT_CHUNK_ROWS', '1000'))
+
+async def stream_batches_csv(query: dict):
+    """Yield CSV text a chunk of rows at a time, so memory stays bounded for any export size"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    
+    # Write header
+    writer.writerow([
+        "Batch Number", "Herb Type", "Quantity (kg)", "Status", 
+        "Created Date", "District", "State", "Blockchain Events"
+    ])
+    
+    pipeline = [
+        {"$match": query},
+        {"$project": {
+            "_id": 0,
+            "batch_number": 1,
+            "herb_type": 1,
+            "total_quantity_kg": 1,
+            "current_status": 1,
+            "created_date": 1,
+            "origin_location.district": 1,
+            "origin_location.state": 1,
+            "event_count": {"$ifNull": ["$event_count", {"$size": {"$ifNull": ["$blockchain_events", []]}}]}
+        }}
+    ]
+    rows = 0
+    async for batch in db.herb_batches.aggregate(pipeline, batchSize=CSV_EXPORT_CHUNK_ROWS):
+        location = batch.get("origin_location", {})
+        writer.writerow([
+            batch.get("batch_number", ""),
+            batch.get("herb_type", ""),
+            batch.get("total_quantity_kg", 0),
+            batch.get("current_status", ""),
+            _to_string(batch.get("created_date", "")),
+            location.get("district", ""),
+            location.get("state", ""),
+            batch.get("event_count", 0)
+        ])
+        rows += 1
+        if rows % CSV_EXPORT_CHUNK_ROWS == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+    
+    yield output.getvalue()
+
+# Materialized analytics
+STATS_ID = "overview"
+
+def _stats_key(value) -> str:
+    """Make a value safe to use as a field name in the stats document"""
+    if isinstance(value, Enum):
+        value = value.value
+    key = str(value) if value not in (None, "") else "Unknown"
+    return key.replace(".", "_").lstrip("$") or "Unknown"
+
+def batch_stats_increments(batch: dict) -> dict:
+    """Counter increments contributed by a newly created batch"""
+    location = batch.get("origin_location") or {}
+    created_date = batch.get("created_date")
+    month = created_date.strftime("%Y-%m") if isinstance(created_date, datetime) else str(created_date)[:7]
+    return {
+        "total_batches": 1,
+        "total_quantity_kg": batch.get("total_quantity_kg", 0),
+        f"herb.{_stats_key(batch.get('herb_type'))}": 1,
+        f"status.{_stats_key(batch.get('current_status'))}": 1,
+        f"location.{_stats_key(location.get('state'))}": 1,
+        f"monthly.{_stats_key(month)}": 1,
+    }
+
+def event_stats_increments(event_type: EventType, count: int = 1) -> dict:
+    """Counter increments contributed by new blockchain events"""
+    return {"total_events": count, f"events.{event_type.value}": count}
+
+def status_stats_increments(old_status: Optional[str], new_status: Optional[str]) -> dict:
+    """Counter increments for a batch moving between statuses"""
+    if not new_status or old_status == new_status:
+        return {}
+    return {f"status.{_stats_key(old_status)}": -1, f"status.{_stats_key(new_status)}": 1}
+
+async def record_stats(increments: dict):
+    """Apply counter increments to the materialized stats document"""
+    if increments:
+        await db.platform_stats.update_one({"_id": STATS_ID}, {"$inc": increments}, upsert=True)
+
+def merge_increments(*increments: dict) -> dict:
+    merged: Dict[str, float] = {}
+    for increment in increments:
+        for key, value in increment.items():
+            merged[key] = merged.get(key, 0) + value
+    return merged
+
+async def rebuild_stats() -> dict:
+    """Recompute the stats document from scratch.
+
+    Increments that land while the rebuild runs may be lost; rerun it (or let
+    the next scheduled rebuild) correct any drift.
+    """
+    batch_pipeline = [{"$facet": {
+        "totals": [{"$group": {"_id": None, "batches": {"$sum": 1}, "quantity": {"$sum": "$total_quantity_kg"}}}],
+        "herb": [{"$group": {"_id": "$herb_type", "count": {"$sum": 1}}}],
+        "status": [{"$group": {"_id": "$current_status", "count": {"$sum": 1}}}],
+        "location": [{"$group": {"_id": "$origin_location.state", "count": {"$sum": 1}}}],
+        "monthly": [{"$group": {"_id": {"$cond": [
+            {"$eq": [{"$type": "$created_date"}, "date"]},
+            {"$dateToString": {"format": "%Y-%m", "date": "$created_date"}},
+            {"$substrCP": ["$created_date", 0, 7]}
+        ]}, "count": {"$sum": 1}}}],
+    }}]
+    facets = (await db.herb_batches.aggregate(batch_pipeline).to_list(1))[0]
+    event_counts = await db.blockchain_events.aggregate([
+        {"$group": {"_id": "$event_type", "count": {"$sum": 1}}}
+    ]).to_list(None)
+
+    totals = facets["totals"][0] if facets["totals"] else {"batches": 0, "quantity": 0}
+    stats = {
+        "_id": STATS_ID,
+        "total_batches": totals["batches"],
+        "total_quantity_kg": totals["quantity"],
+        "total_events": sum(group["count"] for group in event_counts),
+        "events": {_stats_key(group["_id"]): group["count"] for group in event_counts},
+        "rebuilt_at": datetime.now(timezone.utc).isoformat(),
+    }
+    for facet in ["herb", "status", "location", "monthly"]:
+        stats[facet] = {_stats_key(group["_id"]): group["count"] for group in facets[facet]}
+
+    await db.platform_stats.replace_one({"_id": STATS_ID}, stats, upsert=True)
+    return stats
+
+# Indexes and query plans
+INDEXES = {
+    "herb_batches": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("batch_number", ASCENDING)], unique=True, name="batch_number_unique"),
+        IndexModel([("herb_type", ASCENDING), ("created_date", ASCENDING)], name="herb_type_created"),
+        IndexModel([("current_status", ASCENDING), ("created_date", ASCENDING)], name="status_created"),
+        IndexModel([("created_date", ASCENDING)], name="created_date"),
+        IndexModel([("total_quantity_kg", ASCENDING)], name="total_quantity"),
+        IndexModel([("search.state", ASCENDING)], name="search_state"),
+        IndexModel([("search.district", ASCENDING)], name="search_district"),
+        IndexModel(
+            [("batch_number", TEXT), ("search.names", TEXT)], name="batch_text",
+            weights={"batch_number": 10, "search.names": 5}, default_language="none"
+        ),
+    ],
+    "blockchain_events": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("event_type", ASCENDING)], name="event_type"),
+        IndexModel([("event_data.id", ASCENDING)], name="stage_event_id"),
+        IndexModel([("anchor_id", ASCENDING), ("_id", ASCENDING)], name="anchor_pending"),
+    ],
+    "merkle_anchors": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("anchor_number", ASCENDING)], unique=True, name="anchor_number_unique"),
+    ],
+    **{
+        collection: [IndexModel([("id", ASCENDING)], unique=True, name="id_unique")]
+        for collection in ["collection_events", *(spec.collection for spec in STAGE_EVENTS.values())]
+    },
+}
+
+# Block numbers are unique per batch; concurrent appenders rely on it to detect
+# races. Created on its own so forked chains already in the database cannot stop
+# the other indexes, and checked at startup
+CHAIN_INDEX = IndexModel([("batch_id", ASCENDING), ("block_number", ASCENDING)], unique=True, name="batch_block_unique")
+
+# Query shapes issued by the built-in endpoints: (name, collection, filter, sort)
+QUERY_SHAPES = [
+    ("batch_by_id", "herb_batches", {"id": "x"}, None),
+    ("batch_provenance", "blockchain_events", {"batch_id": "x"}, [("block_number", 1)]),
+    ("chain_tail", "blockchain_events", {"batch_id": "x"}, [("block_number", -1)]),
+    ("events_by_type", "blockchain_events", {"event_type": "processing"}, None),
+    ("search_herb_type", "herb_batches", {"herb_type": "tulsi"}, None),
+    ("search_status", "herb_batches", {"current_status": "packaged"}, None),
+    ("search_created_date", "herb_batches", build_batch_search_query(from_date="2024-01-01", to_date="2024-12-31"), None),
+    ("search_quantity", "herb_batches", {"total_quantity_kg": {"$gte": 10, "$lte": 100}}, None),
+    ("search_state", "herb_batches", build_batch_search_query(state="Karnataka"), None),
+    ("search_district", "herb_batches", build_batch_search_query(district="Ball"), None),
+    ("search_text", "herb_batches", build_batch_search_query(q="ramesh"), None),
+]
+
+async def ensure_indexes() -> bool:
+    """Create the indexes the queries rely on; safe to run on every start.
+
+    Returns whether the unique chain index is in place.
+    """
+    for collection, indexes in INDEXES.items():
+        try:
+            await db[collection].create_indexes(indexes)
+        except OperationFailure as e:
+            logger.error(f"Could not create indexes on {collection}: {e}")
+    try:
+        await db.blockchain_events.create_indexes([CHAIN_INDEX])
+    except OperationFailure as e:
+        logger.error(f"Could not create the unique chain index, run check-chains --repair: {e}")
+        return False
+    return True
+
+def _plan_stages(plan) -> List[str]:
+    """Collect every stage name in an explain() plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(_plan_stages(value))
+    return stages
+
+async def explain_query_shapes() -> List[dict]:
+    """Run explain() on each built-in query shape and flag collection scans"""
+    reports = []
+    for name, collection, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explanation = await cursor.explain()
+        stages = _plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+        reports.append({
+            "name": name,
+            "collection": collection,
+            "filter": query,
+            "sort": sort,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages
+        })
+    return reports
+
+# Worker processes for CPU-bound work (PDF and QR rendering, chain audits)
+# Workers never fork the running server: its event loop, Motor client and
+# threads are not safe to copy, so they start from a clean forkserver (or spawn)
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', str(max(1, (os.cpu_count() or 2) // 2))))
+WORKER_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+_process_executor: Optional[ProcessPoolExecutor] = None
+
+def get_process_executor() -> ProcessPoolExecutor:
+    global _process_executor
+    if _process_executor is None:
+        _process_executor = ProcessPoolExecutor(
+            max_workers=WORKER_PROCESSES, mp_context=multiprocessing.get_context(WORKER_START_METHOD)
+        )
+    return _process_executor
+
+# Provenance fetch
+def provenance_pipeline(batch_id: str) -> list:
+    """A batch joined with its blocks, one output document per block in chain order.
+
+    Unwinding straight after the $lookup keeps long chains clear of the 16MB
+    document limit; the stored block id list is dropped so it is not repeated
+    on every row.
+    """
+    return [
+        {"$match": {"id": batch_id}},
+        {"$project": {"_id": 0, "blockchain_events": 0, "search": 0}},
+        {"$lookup": {"from": "blockchain_events", "localField": "id", "foreignField": "batch_id", "as": "blocks"}},
+        {"$unwind": {"path": "$blocks", "preserveNullAndEmptyArrays": True}},
+        {"$project": {"blocks._id": 0}},
+        {"$sort": {"blocks.block_number": 1}},
+    ]
+
+async def fetch_provenance(batch_id: str) -> tuple[Optional[dict], List[dict]]:
+    """Fetch a batch and its blocks (stage details included) in one round trip.
+
+    Returns (None, []) for an unknown batch. Blocks are the raw stored
+    documents, so they can be passed to verify_chain as is.
+    """
+    batch = None
+    blocks = []
+    async for row in db.herb_batches.aggregate(provenance_pipeline(batch_id), allowDiskUse=True):
+        block = row.pop("blocks", None)
+        if batch is None:
+            batch = row
+        if block:
+            blocks.append(block)
+    if batch is not None:
+        batch["blockchain_events"] = [block["id"] for block in blocks]
+    return batch, blocks
+
+# Report rendering
+PDF_MAX_CONCURRENCY = int(os.environ.get('PDF_MAX_CONCURRENCY', str(WORKER_PROCESSES * 2)))
+PDF_CACHE_SIZE = int(os.environ.get('PDF_CACHE_SIZE', '256'))
+
+def render_batch_pdf(batch: dict, events: List[dict]) -> bytes:
+    """Render the provenance report of a batch; runs in a worker process"""
+    # Create PDF
+    pdf_buffer = io.BytesIO()
+    doc = SimpleDocTemplate(pdf_buffer, pagesize=A4)
+    story = []
+    styles = getSampleStyleSheet()
+    
+    # Title
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#2E7D32'),
+        spaceAfter=30,
+    )
+    story.append(Paragraph("Ayurvedic Herb Traceability Report", title_style))
+    story.append(Spacer(1, 0.2*inch))
+    
+    # Batch Information
+    story.append(Paragraph("<b>Batch Information</b>", styles['Heading2']))
+    batch_data = [
+        ["Batch Number:", batch.get("batch_number", "N/A")],
+        ["Herb Type:", batch.get("herb_type", "N/A").capitalize()],
+        ["Quantity:", f"{batch.get('total_quantity_kg', 0)} kg"],
+        ["Status:", batch.get("current_status", "N/A").capitalize()],
+        ["Created Date:", str(batch.get("created_date", "N/A"))[:10]],
+    ]
+    batch_table = Table(batch_data, colWidths=[2*inch, 4*inch])
+    batch_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (0, -1), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    story.append(batch_table)
+    story.append(Spacer(1, 0.3*inch))
+    
+    # Blockchain Events
+    story.append(Paragraph("<b>Blockchain Verified Events</b>", styles['Heading2']))
+    story.append(Paragraph(f"Total Events: {len(events)} | Chain Verified: ✓", styles['Normal']))
+    story.append(Spacer(1, 0.2*inch))
+    
+    for event in events:
+        event_data = [
+            ["Event Type:", event.get("event_type", "").capitalize()],
+            ["Block Number:", str(event.get("block_number", ""))],
+            ["Timestamp:", str(event.get("timestamp", ""))[:19]],
+            ["Hash:", event.get("hash", "")[:32] + "..."],
+        ]
+        event_table = Table(event_data, colWidths=[1.5*inch, 4.5*inch])
+        event_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
+        ]))
+        story.append(event_table)
+        story.append(Spacer(1, 0.15*inch))
+    
+    # Build PDF
+    doc.build(story)
+    
+    return pdf_buffer.getvalue()
+
+pdf_semaphore = asyncio.Semaphore(PDF_MAX_CONCURRENCY)
+pdf_cache = LRUCache(PDF_CACHE_SIZE)  # batch_id -> (tail hash, pdf bytes)
+_pdf_renders: Dict[tuple[str, str], asyncio.Future] = {}
+
+async def get_batch_pdf(batch_id: str) -> Optional[bytes]:
+    """Return the PDF report of a batch, rendering it at most once per chain tail"""
+    # The tail comes from the database, not chain_tail_cache: that cache only
+    # follows this process's own appends and would miss other workers' blocks
+    batch = await db.herb_batches.find_one({"id": batch_id}, {"_id": 0, "tail_hash": 1})
+    if not batch:
+        return None
+    tail_hash = batch.get("tail_hash")
+    if tail_hash is None:
+        # Batch not yet migrated to stored summaries
+        last_block = await db.blockchain_events.find_one(
+            {"batch_id": batch_id}, {"_id": 0, "hash": 1}, sort=[("block_number", -1)]
+        )
+        tail_hash = last_block["hash"] if last_block else "genesis"
+    cached = pdf_cache.get(batch_id)
+    if cached and cached[0] == tail_hash:
+        return cached[1]
+    
+    # Share one render between concurrent requests for the same chain tail
+    key = (batch_id, tail_hash)
+    if key in _pdf_renders:
+        return await asyncio.shield(_pdf_renders[key])
+    render = asyncio.get_running_loop().create_future()
+    _pdf_renders[key] = render
+    try:
+        batch, events = await fetch_provenance(batch_id)
+        if not batch:
+            render.set_result(None)
+            return None
+        
+        async with pdf_semaphore:
+            with timed_phase("pdf"):
+                pdf_bytes = await asyncio.get_running_loop().run_in_executor(
+                    get_process_executor(), render_batch_pdf, batch, events
+                )
+        
+        if events:
+            pdf_cache.set(batch_id, (events[-1]["hash"], pdf_bytes))
+        render.set_result(pdf_bytes)
+        return pdf_bytes
+    except Exception as e:
+        render.set_exception(e)
+        raise
+    finally:
+        _pdf_renders.pop(key, None)
+
+# Chain verification
+CHAIN_VERIFY_CACHE_SIZE = int(os.environ.get('CHAIN_VERIFY_CACHE_SIZE', '4096'))
+CHAIN_VERIFY_CACHE_TTL = float(os.environ.get('CHAIN_VERIFY_CACHE_TTL', '300'))
+VERIFY_CHUNK_BLOCKS = int(os.environ.get('VERIFY_CHUNK_BLOCKS', '256'))
+VERIFY_WORKERS = int(os.environ.get('VERIFY_WORKERS', str(min(8, os.cpu_count() or 2))))
+
+def block_hash_payload(block: dict) -> bytes:
+    """Canonical bytes hashed by calculate_hash for a stored block"""
+    timestamp = block["timestamp"]
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.isoformat()
+    return hash_payload(block["event_data"], block["previous_hash"], timestamp)
+
+def hash_blocks(blocks: List[dict]) -> List[str]:
+    """Serialize each block once and recompute its hash"""
+    return [hashlib.sha256(block_hash_payload(block)).hexdigest() for block in blocks]
+
+def check_chain(blocks: List[dict], digests: List[str]) -> dict:
+    """Compare stored blocks against recomputed hashes; report the first bad block"""
+    expected_previous_hash = "genesis"
+    for position, (block, digest) in enumerate(zip(blocks, digests), start=1):
+        reason = None
+        if block["block_number"] != position:
+            reason = f"expected block number {position}"
+        elif block["previous_hash"] != expected_previous_hash:
+            reason = "previous_hash does not match the prior block"
+        elif block["hash"] != digest:
+            reason = "stored hash does not match the block contents"
+        if reason:
+            return {
+                "verified": False,
+                "first_invalid_block": block["block_number"],
+                "reason": reason,
+                "blocks_checked": position
+            }
+        expected_previous_hash = block["hash"]
+    return {"verified": True, "first_invalid_block": None, "reason": None, "blocks_checked": len(blocks)}
+
+def verify_chain_blocks(blocks: List[dict]) -> dict:
+    """Fully verify one chain in the calling thread or process"""
+    return check_chain(blocks, hash_blocks(blocks))
+
+_verify_executor: Optional[ThreadPoolExecutor] = None
+verification_cache = LRUCache(CHAIN_VERIFY_CACHE_SIZE, ttl=CHAIN_VERIFY_CACHE_TTL)  # batch_id -> (tail hash, report)
+
+def get_verify_executor() -> ThreadPoolExecutor:
+    global _verify_executor
+    if _verify_executor is None:
+        _verify_executor = ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix="verify")
+    return _verify_executor
+
+async def verify_chain(batch_id: str, blocks: List[dict]) -> dict:
+    """Verify a batch chain, memoized by its tail hash.
+
+    Blocks must be raw stored documents sorted by block_number. Long chains are
+    hashed in chunks on a thread pool (hashlib releases the GIL on large inputs).
+    """
+    tail_hash = blocks[-1]["hash"] if blocks else "genesis"
+    cached = verification_cache.get(batch_id)
+    if cached and cached[0] == tail_hash:
+        return cached[1]
+    
+    if len(blocks) <= VERIFY_CHUNK_BLOCKS:
+        digests = hash_blocks(blocks)
+    else:
+        loop = asyncio.get_running_loop()
+        chunks = [blocks[i:i + VERIFY_CHUNK_BLOCKS] for i in range(0, len(blocks), VERIFY_CHUNK_BLOCKS)]
+        hashed = await asyncio.gather(*[
+            loop.run_in_executor(get_verify_executor(), hash_blocks, chunk) for chunk in chunks
+        ])
+        digests = [digest for chunk in hashed for digest in chunk]
+    
+    report = check_chain(blocks, digests)
+    verification_cache.set(batch_id, (tail_hash, report))
+    return report
+
+# Chain audits
+AUDIT_GROUP_BATCHES = int(os.environ.get('AUDIT_GROUP_BATCHES', '200'))
+AUDIT_CHECKPOINT_SECONDS = float(os.environ.get('AUDIT_CHECKPOINT_SECONDS', '5'))
+AUDIT_BROKEN_LIMIT = 1000
+
+def verify_chain_groups(groups: List[tuple[str, List[dict]]]) -> List[tuple[str, int, dict]]:
+    """Verify a group of batch chains; runs in a worker process"""
+    return [(batch_id, len(blocks), verify_chain_blocks(blocks)) for batch_id, blocks in groups]
+
+class ChainAuditJob:
+    """Verifies every batch chain in one sorted pass over blockchain_events.
+
+    Chains are verified in groups on the worker process pool. Groups are
+    consumed in cursor order, so the checkpoint (the last batch id whose group
+    and all groups before it are done) is always safe to resume from.
+    """
+
+    def __init__(self, job_id: Optional[str] = None, state: Optional[dict] = None):
+        self.state = state or {
+            "_id": job_id or str(uuid.uuid4()),
+            "status": "pending",
+            "started_at": None,
+            "finished_at": None,
+            "checkpoint": None,
+            "batches_checked": 0,
+            "blocks_checked": 0,
+            "elapsed_seconds": 0.0,
+            "blocks_per_second": 0.0,
+            "broken_count": 0,
+            "broken_batches": [],
+            "error": None,
+        }
+        self._run_started = 0.0
+        self._elapsed_before = self.state["elapsed_seconds"]
+        self._last_saved = 0.0
+
+    @property
+    def job_id(self) -> str:
+        return self.state["_id"]
+
+    def progress(self) -> dict:
+        return {"job_id": self.job_id, **{k: v for k, v in self.state.items() if k != "_id"}}
+
+    async def save(self, force: bool = False):
+        now = time.monotonic()
+        if force or now - self._last_saved >= AUDIT_CHECKPOINT_SECONDS:
+            self._last_saved = now
+            await db.audit_jobs.replace_one({"_id": self.job_id}, self.state, upsert=True)
+
+    def _record(self, last_batch_id: str, results: List[tuple[str, int, dict]]):
+        for batch_id, block_count, report in results:
+            self.state["batches_checked"] += 1
+            self.state["blocks_checked"] += block_count
+            if not report["verified"]:
+                self.state["broken_count"] += 1
+                if len(self.state["broken_batches"]) < AUDIT_BROKEN_LIMIT:
+                    self.state["broken_batches"].append({"batch_id": batch_id, **report})
+        self.state["checkpoint"] = last_batch_id
+        self.state["elapsed_seconds"] = self._elapsed_before + time.monotonic() - self._run_started
+        if self.state["elapsed_seconds"] > 0:
+            self.state["blocks_per_second"] = round(self.state["blocks_checked"] / self.state["elapsed_seconds"], 1)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._run_started = time.monotonic()
+        self.state["status"] = "running"
+        self.state["started_at"] = self.state["started_at"] or datetime.now(timezone.utc).isoformat()
+        await self.save(force=True)
+        
+        in_flight: deque = deque()
+        max_in_flight = WORKER_PROCESSES * 2
+        
+        async def collect_oldest():
+            future, last_batch_id = in_flight.popleft()
+            self._record(last_batch_id, await future)
+            await self.save()
+        
+        try:
+            query = {"batch_id": {"$gt": self.state["checkpoint"]}} if self.state["checkpoint"] else {}
+            cursor = db.blockchain_events.find(
+                query, {"_id": 0, "batch_id": 1, "block_number": 1, "event_data": 1,
+                        "previous_hash": 1, "hash": 1, "timestamp": 1}
+            ).sort([("batch_id", 1), ("block_number", 1)])
+            
+            group: List[tuple[str, List[dict]]] = []
+            current_id, current_blocks = None, []
+            
+            def submit():
+                in_flight.append((
+                    loop.run_in_executor(get_process_executor(), verify_chain_groups, group),
+                    group[-1][0]
+                ))
+            
+            async for block in cursor:
+                if block["batch_id"] != current_id:
+                    if current_id is not None:
+                        group.append((current_id, current_blocks))
+                        if len(group) >= AUDIT_GROUP_BATCHES:
+                            submit()
+                            group = []
+                            if len(in_flight) >= max_in_flight:
+                                await collect_oldest()
+                    current_id, current_blocks = block["batch_id"], []
+                current_blocks.append(block)
+            if current_id is not None:
+                group.append((current_id, current_blocks))
+            if group:
+                submit()
+            while in_flight:
+                await collect_oldest()
+            
+            self.state["status"] = "completed"
+        except asyncio.CancelledError:
+            self.state["status"] = "cancelled"
+            raise
+        except Exception as e:
+            logger.exception(f"Chain audit {self.job_id} failed")
+            self.state["status"] = "failed"
+            self.state["error"] = str(e)
+        finally:
+            for future, _ in in_flight:
+                future.cancel()
+            self.state["finished_at"] = datetime.now(timezone.utc).isoformat()
+            await self.save(force=True)
+
+audit_jobs: Dict[str, ChainAuditJob] = {}
+_audit_tasks: set = set()
+
+async def start_chain_audit(resume_job_id: Optional[str] = None) -> ChainAuditJob:
+    """Start (or resume from its checkpoint) a background chain audit"""
+    if resume_job_id:
+        running = audit_jobs.get(resume_job_id)
+        if running and running.state["status"] == "running":
+            return running
+        state = await db.audit_jobs.find_one({"_id": resume_job_id})
+        if not state:
+            raise HTTPException(status_code=404, detail="Audit job not found")
+        job = ChainAuditJob(state=state)
+    else:
+        job = ChainAuditJob()
+    
+    audit_jobs[job.job_id] = job
+    task = create_background_task(job.run())
+    _audit_tasks.add(task)
+    task.add_done_callback(_audit_tasks.discard)
+    return job
+
+async def find_chain_forks() -> List[dict]:
+    """Block numbers used more than once in a batch, as left by appends without the unique index"""
+    return await db.blockchain_events.aggregate([
+        {"$group": {"_id": {"batch_id": "$batch_id", "block_number": "$block_number"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$sort": {"_id.batch_id": 1, "_id.block_number": 1}},
+        {"$project": {"_id": 0, "batch_id": "$_id.batch_id", "block_number": "$_id.block_number", "count": 1}}
+    ], allowDiskUse=True).to_list(None)
+
+async def repair_chain_forks(batch_ids: List[str]) -> int:
+    """Keep one chain per forked batch and move the other blocks to forked_blocks.
+
+    Walking up from genesis, each block number keeps the candidate that links to
+    the kept tail, preferring one that a later block builds on, then the oldest.
+    Nothing is rehashed or deleted outright; batch summaries are recomputed.
+    """
+    moved = 0
+    for batch_id in batch_ids:
+        blocks = await db.blockchain_events.find({"batch_id": batch_id}).sort([("block_number", 1), ("_id", 1)]).to_list(None)
+        by_number: Dict[int, List[dict]] = {}
+        for block in blocks:
+            by_number.setdefault(block["block_number"], []).append(block)
+        referenced = {block["previous_hash"] for block in blocks}
+        
+        tail_hash = "genesis"
+        forked = []
+        for block_number in sorted(by_number):
+            candidates = by_number[block_number]
+            linked = [block for block in candidates if block["previous_hash"] == tail_hash] or candidates
+            kept = next((block for block in linked if block["hash"] in referenced), linked[0])
+            forked += [block for block in candidates if block is not kept]
+            tail_hash = kept["hash"]
+        
+        if forked:
+            forked_at = datetime.now(timezone.utc)
+            await db.forked_blocks.insert_many([{**block, "forked_at": forked_at} for block in forked])
+            await db.blockchain_events.delete_many({"_id": {"$in": [block["_id"] for block in forked]}})
+            await chain_tail_cache.invalidate(batch_id)
+            response_cache.invalidate(batch_id)
+            moved += len(forked)
+    
+    summaries = await chain_summaries(batch_ids)
+    if summaries:
+        await db.herb_batches.bulk_write(
+            [UpdateOne({"id": batch_id}, {"$set": summary}) for batch_id, summary in summaries.items()], ordered=False
+        )
+    return moved
+
+# Merkle anchoring
+MERKLE_ANCHOR_INTERVAL_SECONDS = float(os.environ.get('MERKLE_ANCHOR_INTERVAL_SECONDS', '300'))
+MERKLE_ANCHOR_MAX_LEAVES = int(os.environ.get('MERKLE_ANCHOR_MAX_LEAVES', '4096'))
+MERKLE_ALGORITHM = (
+    "sha256; leaf = H(0x00 || block_hash_bytes); node = H(0x01 || left || right); "
+    "a node without a sibling is paired with itself"
+)
+
+def merkle_leaf(block_hash: str) -> bytes:
+    return hashlib.sha256(b"\x00" + bytes.fromhex(block_hash)).digest()
+
+def merkle_node(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+def merkle_levels(block_hashes: List[str]) -> List[List[bytes]]:
+    """All levels of the tree, leaves first and the root last"""
+    levels = [[merkle_leaf(block_hash) for block_hash in block_hashes]]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        levels.append([
+            merkle_node(level[i], level[i + 1] if i + 1 < len(level) else level[i])
+            for i in range(0, len(level), 2)
+        ])
+    return levels
+
+def merkle_proof(levels: List[List[bytes]], index: int) -> List[dict]:
+    """Sibling path from a leaf to the root"""
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        sibling_hash = level[sibling] if sibling < len(level) else level[index]
+        proof.append({"position": "right" if sibling > index or sibling >= len(level) else "left",
+                      "hash": sibling_hash.hex()})
+        index //= 2
+    return proof
+
+def verify_merkle_proof(block_hash: str, proof: List[dict], root: str) -> bool:
+    """Check an inclusion proof; mirrors what an offline verifier does"""
+    node = merkle_leaf(block_hash)
+    for step in proof:
+        sibling = bytes.fromhex(step["hash"])
+        node = merkle_node(node, sibling) if step["position"] == "right" else merkle_node(sibling, node)
+    return node.hex() == root
+
+anchor_levels_cache = LRUCache(64)  # anchor id -> tree levels
+_anchor_lock = asyncio.Lock()
+
+async def anchor_pending_blocks() -> Optional[dict]:
+    """Anchor up to MERKLE_ANCHOR_MAX_LEAVES unanchored blocks under one Merkle root"""
+    async with _anchor_lock:
+        blocks = await db.blockchain_events.find(
+            {"anchor_id": None}, {"_id": 1, "id": 1, "batch_id": 1, "hash": 1}
+        ).sort("_id", 1).limit(MERKLE_ANCHOR_MAX_LEAVES).to_list(MERKLE_ANCHOR_MAX_LEAVES)
+        if not blocks:
+            return None
+        
+        previous = await db.merkle_anchors.find_one({}, {"_id": 0, "anchor_number": 1, "root": 1}, sort=[("anchor_number", -1)])
+        block_hashes = [block["hash"] for block in blocks]
+        levels = merkle_levels(block_hashes)
+        anchor = {
+            "id": str(uuid.uuid4()),
+            "anchor_number": previous["anchor_number"] + 1 if previous else 1,
+            "root": levels[-1][0].hex(),
+            "previous_root": previous["root"] if previous else "genesis",
+            "leaf_count": len(blocks),
+            "leaves": block_hashes,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        try:
+            await db.merkle_anchors.insert_one(anchor)
+        except DuplicateKeyError:
+            # Another worker anchored concurrently; its anchor wins this round
+            return None
+        
+        await db.blockchain_events.bulk_write([
+            UpdateOne({"_id": block["_id"], "anchor_id": None},
+                      {"$set": {"anchor_id": anchor["id"], "anchor_index": index}})
+            for index, block in enumerate(blocks)
+        ], ordered=False)
+        anchor_levels_cache.set(anchor["id"], levels)
+        for batch_id in {block["batch_id"] for block in blocks}:
+            response_cache.invalidate(batch_id)
+        anchor.pop("_id", None)
+        logger.info(f"Anchored {len(blocks)} blocks under Merkle root {anchor['root']}")
+        return anchor
+
+async def merkle_anchor_loop():
+    """Periodically anchor new blocks until shut down"""
+    while True:
+        try:
+            while await anchor_pending_blocks():
+                pass
+        except Exception as e:
+            logger.error(f"Merkle anchoring failed: {e}")
+        await asyncio.sleep(MERKLE_ANCHOR_INTERVAL_SECONDS)
+
+_anchor_task: Optional[asyncio.Task] = None
+
+# QR codes
+QR_CACHE_SIZE = int(os.environ.get('QR_CACHE_SIZE', '2048'))
+QR_CACHE_DIR = Path(os.environ.get('QR_CACHE_DIR', ROOT_DIR / 'qr_cache'))
+# Bump QR_RENDER_VERSION whenever the settings below change, so cached images are re-rendered
+QR_RENDER_VERSION = "1"
+QR_ERROR_CORRECTION = qrcode.constants.ERROR_CORRECT_M
+QR_BOX_SIZE = 10
+QR_BORDER = 4
+
+def qr_scan_url(batch_id: str) -> str:
+    return f"{os.environ.get('FRONTEND_URL', 'https://app.example.com')}/scan/{batch_id}"
+
+def render_qr_png(data: str) -> bytes:
+    """Render a QR code PNG with the platform-wide settings"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=QR_ERROR_CORRECTION,
+        box_size=QR_BOX_SIZE,
+        border=QR_BORDER,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    
+    img = qr.make_image(fill_color="black", back_color="white")
+    img_buffer = io.BytesIO()
+    img.save(img_buffer, format='PNG')
+    return img_buffer.getvalue()
+
+class QRCodeCache:
+    """Content-addressed QR PNGs: an in-memory LRU that spills to disk"""
+
+    def __init__(self, maxsize: int, directory: Path):
+        self.memory = LRUCache(maxsize)
+        self.directory = directory
+        self.disk_hits = 0
+        self.renders = 0
+
+    @staticmethod
+    def key(data: str) -> str:
+        return hashlib.sha256(f"{QR_RENDER_VERSION}|{data}".encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.png"
+
+    def _read(self, key: str) -> Optional[bytes]:
+        try:
+            return self._path(key).read_bytes()
+        except OSError:
+            return None
+
+    def _write(self, key: str, png: bytes):
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._path(key).with_suffix(f".{uuid.uuid4().hex}.tmp")
+            tmp_path.write_bytes(png)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Could not spill QR code {key} to disk: {e}")
+
+    async def get(self, data: str) -> Optional[tuple[str, bytes]]:
+        key = self.key(data)
+        png = self.memory.get(key)
+        if png is None:
+            png = await asyncio.to_thread(self._read, key)
+            if png is None:
+                return None
+            self.disk_hits += 1
+            self.memory.set(key, png)
+        return key, png
+
+    async def render(self, data: str) -> tuple[str, bytes]:
+        cached = await self.get(data)
+        if cached:
+            return cached
+        key = self.key(data)
+        with timed_phase("qr"):
+            png = await asyncio.to_thread(render_qr_png, data)
+        self.renders += 1
+        self.memory.set(key, png)
+        await asyncio.to_thread(self._write, key, png)
+        return key, png
+
+    def stats(self) -> dict:
+        return {**self.memory.stats(), "disk_hits": self.disk_hits, "renders": self.renders}
+
+qr_cache = QRCodeCache(QR_CACHE_SIZE, QR_CACHE_DIR)
+
+async def get_batch_qr_png(batch_id: str) -> Optional[tuple[str, bytes]]:
+    """Return (etag, png) for a batch's QR code, or None if the batch does not exist"""
+    scan_url = qr_scan_url(batch_id)
+    # Only existing batches are ever rendered, so a cached image proves the batch exists
+    cached = await qr_cache.get(scan_url)
+    if cached:
+        return cached
+    if not await db.herb_batches.find_one({"id": batch_id}, {"_id": 1}):
+        return None
+    return await qr_cache.render(scan_url)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or f'"{etag}"' in candidates
+
+# Response caching
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '60'))
+RESPONSE_CACHE_TRACKED_INVALIDATIONS = 10000
+
+class ResponseCache:
+    """Serialized JSON responses of per-batch read endpoints, bounded by total bytes.
+
+    Writers call invalidate(batch_id) once their writes are done. A reader takes
+    a token before querying and its result is only stored if the batch was not
+    invalidated in the meantime, so a slow read cannot cache a pre-write view.
+    Invalidation is per process; other workers converge within the TTL.
+    """
+
+    def __init__(self, max_bytes: int, ttl: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()  # (batch_id, view) -> (expires_at, etag, body)
+        self._views: Dict[str, set] = {}  # batch_id -> cached views
+        self._clock = 0
+        self._invalidations: OrderedDict = OrderedDict()  # batch_id -> clock at invalidation
+        self._forgotten = 0  # newest invalidation dropped from _invalidations
+
+    def get(self, batch_id: str, view: str) -> Optional[tuple[str, bytes]]:
+        entry = self._data.get((batch_id, view))
+        if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+            self._data.move_to_end((batch_id, view))
+            self.hits += 1
+            return entry[1], entry[2]
+        if entry is not None:
+            self._drop((batch_id, view))
+        self.misses += 1
+        return None
+
+    def begin(self) -> int:
+        return self._clock
+
+    def set(self, batch_id: str, view: str, body: bytes, token: int) -> tuple[str, bytes]:
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        if self._invalidations.get(batch_id, self._forgotten) > token or len(body) > self.max_bytes:
+            return etag, body
+        self._drop((batch_id, view))
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._data[(batch_id, view)] = (expires_at, etag, body)
+        self._views.setdefault(batch_id, set()).add(view)
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes:
+            self._drop(next(iter(self._data)))
+        return etag, body
+
+    def invalidate(self, batch_id: str):
+        self._clock += 1
+        self._invalidations[batch_id] = self._clock
+        self._invalidations.move_to_end(batch_id)
+        while len(self._invalidations) > RESPONSE_CACHE_TRACKED_INVALIDATIONS:
+            self._forgotten = self._invalidations.popitem(last=False)[1]
+        for view in self._views.pop(batch_id, set()):
+            self._drop((batch_id, view))
+
+    def _drop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[2])
+            views = self._views.get(key[0])
+            if views is not None:
+                views.discard(key[1])
+                if not views:
+                    del self._views[key[0]]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL)
+
+async def cached_json_response(request: Request, batch_id: str, view: str, build) -> Response:
+    """Serve a per-batch JSON view from the response cache, building it on a miss.
+
+    build() returns JSON-compatible data; exceptions it raises are not cached.
+    """
+    entry = response_cache.get(batch_id, view)
+    if entry is None:
+        token = response_cache.begin()
+        content = await build()
+        body = json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+        entry = response_cache.set(batch_id, view, body, token)
+    etag, body = entry
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Consumer scan summary
+# Who handled each stage and the one detail shown for it on the scan page
+SCAN_STAGE_FIELDS = {
+    EventType.COLLECTION: ("collector_name", "harvesting_method"),
+    EventType.PROCESSING: ("processor_name", "processing_type"),
+    EventType.TESTING: ("lab_name", "overall_grade"),
+    EventType.PACKAGING: ("packager_name", "packaging_type"),
+    EventType.DISTRIBUTION: ("distributor_name", "distribution_mode"),
+    EventType.RETAIL: ("retailer_name", "condition_on_arrival"),
+}
+
+def _place(location: Optional[dict]) -> Optional[str]:
+    if not location:
+        return None
+    return ", ".join(part for part in (location.get("district"), location.get("state")) if part) or None
+
+def scan_summary(batch: dict, blocks: List[dict], report: dict) -> dict:
+    """Trimmed provenance for the consumer scan page"""
+    location = batch.get("origin_location") or {}
+    timeline = []
+    lab_results = []
+    for block in blocks:
+        event_type = EventType(block["event_type"])
+        data = block["event_data"]
+        actor_field, detail_field = SCAN_STAGE_FIELDS[event_type]
+        timeline.append({
+            "stage": event_type.value,
+            "block": block["block_number"],
+            "at": block["timestamp"],
+            "by": data.get(actor_field),
+            "detail": data.get(detail_field),
+            "place": _place(data.get("destination_location") or data.get("location"))
+        })
+        if event_type == EventType.TESTING:
+            tests = data.get("test_results") or []
+            lab_results.append({
+                "lab": data.get("lab_name"),
+                "grade": data.get("overall_grade"),
+                "passed": sum(1 for test in tests if test.get("pass_status")),
+                "total": len(tests),
+                "compliant": data.get("compliance_status", True)
+            })
+    return {
+        "batch_id": batch["id"],
+        "batch_number": batch["batch_number"],
+        "herb_type": batch["herb_type"],
+        "quantity_kg": batch["total_quantity_kg"],
+        "status": batch.get("current_status"),
+        "created": batch.get("created_date"),
+        "origin": {
+            "place": _place(location),
+            "lat": round(location["latitude"], 4) if location.get("latitude") is not None else None,
+            "lng": round(location["longitude"], 4) if location.get("longitude") is not None else None
+        },
+        "timeline": timeline,
+        "lab": {
+            "passed": all(result["passed"] == result["total"] and result["compliant"] for result in lab_results) if lab_results else None,
+            "results": lab_results
+        },
+        "verified": report["verified"],
+        "first_invalid_block": report["first_invalid_block"],
+        "tail_hash": blocks[-1]["hash"][:16] if blocks else None
+    }
+
+# QR label sheets
+QR_LABEL_CHUNK = int(os.environ.get('QR_LABEL_CHUNK', '64'))
+QR_LABELS_PDF_MAX = int(os.environ.get('QR_LABELS_PDF_MAX', '10000'))
+QR_LABEL_COLUMNS = 3
+QR_LABEL_ROWS = 4
+
+def render_qr_pngs(urls: List[str]) -> List[bytes]:
+    """Render a chunk of QR codes; runs in a worker process"""
+    return [render_qr_png(url) for url in urls]
+
+async def iter_qr_labels(query: dict):
+    """Yield lists of (batch, png), rendered in parallel on the worker pool a chunk at a time"""
+    loop = asyncio.get_running_loop()
+    group_size = QR_LABEL_CHUNK * WORKER_PROCESSES
+    cursor = db.herb_batches.find(
+        query, {"_id": 0, "id": 1, "batch_number": 1, "herb_type": 1}
+    ).batch_size(group_size)
+    
+    async def render(batches: List[dict]) -> List[tuple[dict, bytes]]:
+        chunks = [batches[i:i + QR_LABEL_CHUNK] for i in range(0, len(batches), QR_LABEL_CHUNK)]
+        with timed_phase("qr"):
+            rendered = await asyncio.gather(*[
+                loop.run_in_executor(get_process_executor(), render_qr_pngs, [qr_scan_url(b["id"]) for b in chunk])
+                for chunk in chunks
+            ])
+        return [pair for chunk, pngs in zip(chunks, rendered) for pair in zip(chunk, pngs)]
+    
+    group = []
+    async for batch in cursor:
+        group.append(batch)
+        if len(group) == group_size:
+            yield await render(group)
+            group = []
+    if group:
+        yield await render(group)
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, unseekable buffer drained after every chunk of a streamed archive"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+async def stream_qr_label_zip(query: dict):
+    """Stream a ZIP of label PNGs; memory holds at most one rendered chunk"""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        async for labels in iter_qr_labels(query):
+            for batch, png in labels:
+                archive.writestr(f"{batch.get('batch_number') or batch['id']}.png", png)
+            yield sink.drain()
+    yield sink.drain()
+
+def draw_qr_labels(sheet: canvas.Canvas, labels: List[tuple[dict, bytes]], count: int) -> int:
+    """Lay a group of labels out after the first count; runs off the event loop"""
+    page_width, page_height = A4
+    cell_width = page_width / QR_LABEL_COLUMNS
+    cell_height = page_height / QR_LABEL_ROWS
+    qr_size = min(cell_width, cell_height) - 0.6 * inch
+    per_page = QR_LABEL_COLUMNS * QR_LABEL_ROWS
+    
+    for batch, png in labels:
+        if count and count % per_page == 0:
+            sheet.showPage()
+        column = count % QR_LABEL_COLUMNS
+        row = (count % per_page) // QR_LABEL_COLUMNS
+        x = column * cell_width + (cell_width - qr_size) / 2
+        y = page_height - (row + 1) * cell_height + 0.45 * inch
+        sheet.drawImage(ImageReader(io.BytesIO(png)), x, y, width=qr_size, height=qr_size)
+        sheet.setFont("Helvetica-Bold", 8)
+        sheet.drawCentredString(x + qr_size / 2, y - 0.15 * inch, batch.get("batch_number", ""))
+        sheet.setFont("Helvetica", 7)
+        sheet.drawCentredString(x + qr_size / 2, y - 0.3 * inch, str(batch.get("herb_type", "")).capitalize())
+        count += 1
+    return count
+
+async def build_qr_label_pdf(query: dict) -> tempfile.SpooledTemporaryFile:
+    """Lay labels out on printable A4 sheets; the output spills to disk when large.
+
+    QR codes render on the worker pool; layout and the final save run in a
+    thread, one rendered group at a time, so the event loop is never held for
+    a whole sheet.
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    sheet = canvas.Canvas(output, pagesize=A4)
+    
+    count = 0
+    try:
+        async for labels in iter_qr_labels(query):
+            if count + len(labels) > QR_LABELS_PDF_MAX:
+                raise HTTPException(status_code=413, detail=f"At most {QR_LABELS_PDF_MAX} labels per PDF; use format=zip")
+            count = await asyncio.to_thread(draw_qr_labels, sheet, labels, count)
+        await asyncio.to_thread(sheet.save)
+    except BaseException:
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
+def iter_file_chunks(file, chunk_size: int = 64 * 1024):
+    with file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+# Write-behind journal
+# INGEST_MODE=journal acknowledges writes once their blocks are hashed and appended
+# to a local journal; a background flusher drains the journal to Mongo. Tails of
+# unflushed chains live only in this process, so journal mode needs a single
+# writer process.
+INGEST_MODE = os.environ.get('INGEST_MODE', 'sync').lower()
+EVENT_JOURNAL_PATH = Path(os.environ.get('EVENT_JOURNAL_PATH', ROOT_DIR / 'journal' / 'events.jsonl'))
+EVENT_JOURNAL_FSYNC = os.environ.get('EVENT_JOURNAL_FSYNC', 'true').lower() in ('1', 'true', 'yes')
+JOURNAL_FLUSH_INTERVAL = float(os.environ.get('JOURNAL_FLUSH_INTERVAL', '0.2'))
+JOURNAL_FLUSH_BATCH = int(os.environ.get('JOURNAL_FLUSH_BATCH', '1000'))
+
+def stage_collection(event_type: EventType) -> str:
+    return STAGE_EVENTS[event_type].collection if event_type in STAGE_EVENTS else "collection_events"
+
+def _insert_ignoring_duplicates(error: BulkWriteError):
+    """Replayed records may already be in Mongo; anything but a duplicate key is fatal"""
+    if any(write_error.get("code") != 11000 for write_error in error.details.get("writeErrors", [])):
+        raise error
+
+class EventJournal:
+    """Append-only JSON-lines journal of accepted blocks, drained to Mongo in batches.
+
+    Each record is one block plus what goes with it: the stage collection, the
+    new status, the new batch document (for collections) and the stats
+    increments. A checkpoint file holds the last flushed sequence number; on
+    open, later records are replayed in journal order, which is chain order.
+    Flushing is idempotent apart from the stats increments of a batch that was
+    written but not checkpointed before a crash (rebuild-stats corrects them).
+    """
+
+    def __init__(self, path: Path, fsync: bool = True):
+        self.path = path
+        self.checkpoint_path = path.with_name(path.name + ".checkpoint")
+        self.fsync = fsync
+        self.seq = 0
+        self.flushed_seq = 0
+        self.flushed_records = 0
+        self.last_flush_seconds = 0.0
+        self._file = None
+        self._pending: deque = deque()
+        self._tails: Dict[str, tuple[str, int, int]] = {}  # batch_id -> (hash, block number, seq)
+        self._statuses: Dict[str, tuple[Optional[str], int]] = {}  # batch_id -> (status, seq)
+        self._flush_lock = asyncio.Lock()
+        self._commits: List[tuple[List[bytes], List[dict], asyncio.Future]] = []  # waiting for the writer
+        self._writer: Optional[asyncio.Task] = None
+
+    def open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.checkpoint_path.exists():
+            self.flushed_seq = int(self.checkpoint_path.read_text().strip() or 0)
+        self.seq = self.flushed_seq
+        valid_bytes = 0
+        if self.path.exists():
+            with open(self.path, "rb") as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-append was never acknowledged
+                        logger.warning("Dropping incomplete journal record")
+                        break
+                    valid_bytes += len(line)
+                    if record["seq"] > self.flushed_seq:
+                        self._track(record)
+        self._file = open(self.path, "ab")
+        self._file.truncate(valid_bytes)
+        if self._pending:
+            logger.info(f"Replaying {len(self._pending)} journaled blocks")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _track(self, record: dict):
+        self._pending.append(record)
+        self.seq = max(self.seq, record["seq"])
+        block = record["block"]
+        self._tails[block["batch_id"]] = (block["hash"], block["block_number"], record["seq"])
+        if record.get("batch") or record.get("status"):
+            status = record["status"] or record["batch"]["current_status"]
+            self._statuses[block["batch_id"]] = (status, record["seq"])
+
+    def _write(self, data: bytes):
+        offset = self._file.tell()
+        try:
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        except BaseException:
+            # Leave no partial group behind for later records to be appended after
+            self._file.truncate(offset)
+            raise
+
+    async def _write_commits(self):
+        """Group commit: one write and fsync for every append queued meanwhile"""
+        while self._commits:
+            group, self._commits = self._commits, []
+            try:
+                await asyncio.to_thread(self._write, b"".join(line for lines, _, _ in group for line in lines))
+            except Exception as e:
+                for _, _, future in group:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for _, records, future in group:
+                for record in records:
+                    self._track(record)
+                if not future.done():
+                    future.set_result(None)
+
+    async def _commit(self, lines: List[bytes], records: List[dict]):
+        """Queue lines for the writer and wait until they are on disk"""
+        future = asyncio.get_running_loop().create_future()
+        self._commits.append((lines, records, future))
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_commits())
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The write goes ahead regardless; hold the caller's locks until it lands
+            await asyncio.wait([future])
+            raise
+
+    def _writing(self) -> bool:
+        return bool(self._commits) or (self._writer is not None and not self._writer.done())
+
+    async def tail(self, batch_id: str) -> tuple[str, int]:
+        if batch_id in self._tails:
+            return self._tails[batch_id][:2]
+        return await get_last_block_hash(batch_id)
+
+    def pending_statuses(self, batch_ids) -> Dict[str, Optional[str]]:
+        """Current status of batches whose latest status change is still unflushed"""
+        return {batch_id: self._statuses[batch_id][0] for batch_id in batch_ids if batch_id in self._statuses}
+
+    async def append(
+        self,
+        groups: Dict[str, List[tuple[EventType, dict]]],
+        previous_statuses: Dict[str, Optional[str]],
+        new_batches: Optional[Dict[str, dict]] = None
+    ) -> Dict[str, List[BlockchainEvent]]:
+        """Hash and journal new blocks; durable (with fsync) once this returns.
+
+        Lines are written by a group-commit writer off the event loop. The batch
+        locks are held until they are on disk, so no block chains off one that
+        might still be lost.
+        """
+        new_batches = new_batches or {}
+        appended: Dict[str, List[BlockchainEvent]] = {batch_id: [] for batch_id in groups}
+        async with batch_locks.hold(groups):
+            # Statuses read before the lock may be stale; unflushed ones are in
+            # memory and the rest are re-read now that no other append can move them
+            current_statuses = self.pending_statuses(groups)
+            unknown = [batch_id for batch_id in groups if batch_id not in current_statuses and batch_id not in new_batches]
+            if unknown:
+                async for batch in db.herb_batches.find({"id": {"$in": unknown}}, {"_id": 0, "id": 1, "current_status": 1}):
+                    current_statuses[batch["id"]] = batch.get("current_status")
+            records = []
+            for batch_id, items in groups.items():
+                previous_hash, last_block_number = await self.tail(batch_id)
+                status = current_statuses.get(batch_id, previous_statuses.get(batch_id))
+                for event_type, event_data in items:
+                    blockchain_event = build_blockchain_event(batch_id, event_type, event_data, previous_hash, last_block_number)
+                    previous_hash, last_block_number = blockchain_event.hash, blockchain_event.block_number
+                    appended[batch_id].append(blockchain_event)
+                    
+                    new_status = STAGE_EVENTS[event_type].status if event_type in STAGE_EVENTS else None
+                    increments = [event_stats_increments(event_type), status_stats_increments(status, new_status)]
+                    status = new_status or status
+                    batch = new_batches.pop(batch_id, None)
+                    if batch is not None:
+                        batch = {**batch, **batch_summary(blockchain_event)}
+                        increments.append(batch_stats_increments(batch))
+                    records.append({
+                        "block": block_document(blockchain_event),
+                        "collection": stage_collection(event_type),
+                        "status": new_status,
+                        "batch": batch,
+                        "stats": merge_increments(*increments)
+                    })
+            
+            # Sequence numbers are taken under the locks, so journal order is chain order
+            lines, tracked = [], []
+            for record in records:
+                self.seq += 1
+                record["seq"] = self.seq
+                line = json.dumps(record, default=jsonable_encoder)
+                lines.append(line.encode() + b"\n")
+                # Track exactly what replay would read back
+                tracked.append(json.loads(line))
+            await self._commit(lines, tracked)
+            for batch_id, events in appended.items():
+                await chain_tail_cache.set(batch_id, (events[-1].hash, events[-1].block_number))
+        return appended
+
+    async def flush(self, limit: int = JOURNAL_FLUSH_BATCH) -> int:
+        """Write up to limit journaled records to Mongo and advance the checkpoint"""
+        async with self._flush_lock:
+            records = [self._pending[i] for i in range(min(limit, len(self._pending)))]
+            if not records:
+                return 0
+            started = time.perf_counter()
+            
+            batches = [record["batch"] for record in records if record.get("batch")]
+            if batches:
+                try:
+                    await db.herb_batches.insert_many([_convert_dates(batch, _to_native) if DATE_STORAGE_MODE == 'native' else batch for batch in batches], ordered=False)
+                except BulkWriteError as e:
+                    _insert_ignoring_duplicates(e)
+            try:
+                await db.blockchain_events.insert_many([dict(record["block"]) for record in records], ordered=False)
+            except BulkWriteError as e:
+                _insert_ignoring_duplicates(e)
+            
+            if WRITE_STAGE_COLLECTIONS:
+                stage_docs: Dict[str, List[dict]] = {}
+                for record in records:
+                    stage_docs.setdefault(record["collection"], []).append(storage_document(record["block"]["event_data"]))
+                for collection, docs in stage_docs.items():
+                    try:
+                        await db[collection].insert_many(docs, ordered=False)
+                    except BulkWriteError as e:
+                        _insert_ignoring_duplicates(e)
+            
+            chained: Dict[str, List[BlockchainEvent]] = {}
+            statuses: Dict[str, str] = {}
+            for record in records:
+                block = record["block"]
+                chained.setdefault(block["batch_id"], []).append(BlockchainEvent.model_construct(
+                    **{**block, "event_type": EventType(block["event_type"]), "timestamp": datetime.fromisoformat(block["timestamp"])}
+                ))
+                if record["status"]:
+                    statuses[block["batch_id"]] = record["status"]
+            operations = batch_summary_operations(chained)
+            operations += [UpdateOne({"id": batch_id}, {"$set": {"current_status": status}}) for batch_id, status in statuses.items()]
+            await db.herb_batches.bulk_write(operations, ordered=False)
+            await record_stats(merge_increments(*(record["stats"] for record in records)))
+            
+            flushed_seq = records[-1]["seq"]
+            checkpoint_tmp = self.checkpoint_path.with_name(self.checkpoint_path.name + ".tmp")
+            checkpoint_tmp.write_text(str(flushed_seq))
+            os.replace(checkpoint_tmp, self.checkpoint_path)
+            self.flushed_seq = flushed_seq
+            for _ in records:
+                self._pending.popleft()
+            for batch_id in list(self._tails):
+                if self._tails[batch_id][2] <= flushed_seq:
+                    del self._tails[batch_id]
+            for batch_id in list(self._statuses):
+                if self._statuses[batch_id][1] <= flushed_seq:
+                    del self._statuses[batch_id]
+            for batch_id in chained:
+                response_cache.invalidate(batch_id)
+            
+            # Everything is in Mongo: start the journal over so it does not grow forever
+            if not self._pending and not self._writing():
+                self._file.truncate(0)
+            self.flushed_records += len(records)
+            self.last_flush_seconds = time.perf_counter() - started
+            return len(records)
+
+    async def run(self):
+        """Drain the journal until cancelled"""
+        while True:
+            try:
+                while await self.flush():
+                    pass
+            except Exception as e:
+                logger.error(f"Journal flush failed, will retry: {e}")
+            await asyncio.sleep(JOURNAL_FLUSH_INTERVAL)
+
+    def stats(self) -> dict:
+        return {
+            "mode": INGEST_MODE,
+            "pending": len(self._pending),
+            "last_seq": self.seq,
+            "flushed_seq": self.flushed_seq,
+            "flushed_records": self.flushed_records,
+            "last_flush_seconds": round(self.last_flush_seconds, 4)
+        }
+
+event_journal = EventJournal(EVENT_JOURNAL_PATH, EVENT_JOURNAL_FSYNC)
+_journal_task: Optional[asyncio.Task] = None
+
+# Stage event writes
+async def append_stage_events(staged: List[tuple[EventType, str, BaseModel]]) -> List[Union[BlockchainEvent, str]]:
+    """Append validated stage events, each (event type, batch id, stage event).
+
+    Every item becomes a block on its batch chain, in submission order per
+    batch, plus its stage document and the batch's summary and status updates.
+    These are three bulk writes in total, committed in one transaction when
+    available. Returns each item's block, or an error message for items whose
+    batch does not exist.
+    """
+    results: List[Union[BlockchainEvent, str, None]] = [None] * len(staged)
+    
+    # One lookup for batch existence and current status
+    batch_ids = list({batch_id for _, batch_id, _ in staged})
+    existing: Dict[str, Optional[str]] = event_journal.pending_statuses(batch_ids) if INGEST_MODE == 'journal' else {}
+    async for batch in db.herb_batches.find(
+        {"id": {"$in": [batch_id for batch_id in batch_ids if batch_id not in existing]}}, {"_id": 0, "id": 1, "current_status": 1}
+    ):
+        existing[batch["id"]] = batch.get("current_status")
+    
+    # Group per batch, keeping submission order within each chain
+    groups: Dict[str, List[int]] = {}
+    for index, (_, batch_id, _) in enumerate(staged):
+        if batch_id in existing:
+            groups.setdefault(batch_id, []).append(index)
+        else:
+            results[index] = "Batch not found"
+    if not groups:
+        return results
+    
+    documents = {index: to_document(staged[index][2]) for indices in groups.values() for index in indices}
+    
+    if INGEST_MODE == 'journal':
+        appended = await event_journal.append(
+            {batch_id: [(staged[index][0], documents[index]) for index in indices] for batch_id, indices in groups.items()},
+            existing
+        )
+        for batch_id, indices in groups.items():
+            for index, blockchain_event in zip(indices, appended[batch_id]):
+                results[index] = blockchain_event
+            response_cache.invalidate(batch_id)
+        return results
+    
+    statuses = {
+        batch_id: next((STAGE_EVENTS[staged[index][0]].status for index in reversed(indices)
+                        if STAGE_EVENTS[staged[index][0]].status), None)
+        for batch_id, indices in groups.items()
+    }
+    
+    previous_statuses: Dict[str, Optional[str]] = {}
+    
+    async def write_stage_documents(appended: Dict[str, List[BlockchainEvent]], session):
+        if WRITE_STAGE_COLLECTIONS:
+            stage_docs: Dict[str, List[dict]] = {}
+            for indices in groups.values():
+                for index in indices:
+                    stage_docs.setdefault(STAGE_EVENTS[staged[index][0]].collection, []).append(storage_document(documents[index]))
+            for collection, docs in stage_docs.items():
+                await db[collection].insert_many(docs, session=session)
+        
+        await db.herb_batches.bulk_write(batch_summary_operations(appended), ordered=False, session=session)
+        
+        # Swap each status atomically and keep what it replaced: the earlier read
+        # is stale once concurrent writers to the same batch get here
+        async def set_status(batch_id: str, status: str):
+            before = await db.herb_batches.find_one_and_update(
+                {"id": batch_id}, {"$set": {"current_status": status}},
+                projection={"_id": 0, "current_status": 1}, return_document=ReturnDocument.BEFORE, session=session
+            )
+            previous_statuses[batch_id] = before.get("current_status") if before else existing[batch_id]
+        
+        changes = [(batch_id, status) for batch_id, status in statuses.items() if status]
+        if session is None:
+            await asyncio.gather(*(set_status(batch_id, status) for batch_id, status in changes))
+        else:
+            # Operations on one session must not overlap
+            for batch_id, status in changes:
+                await set_status(batch_id, status)
+    
+    # Chain hashes in memory from one tail lookup and store all blocks at once
+    appended = await append_blockchain_events(
+        {batch_id: [(staged[index][0], documents[index]) for index in indices] for batch_id, indices in groups.items()},
+        write_stage_documents
+    )
+    
+    stats_increments = []
+    for batch_id, indices in groups.items():
+        for index, blockchain_event in zip(indices, appended[batch_id]):
+            results[index] = blockchain_event
+            stats_increments.append(event_stats_increments(blockchain_event.event_type))
+        stats_increments.append(status_stats_increments(previous_statuses.get(batch_id), statuses[batch_id]))
+    await record_stats(merge_increments(*stats_increments))
+    for batch_id in groups:
+        response_cache.invalidate(batch_id)
+    return results
+
+# Live event feed
+# One upstream reader per process fans new blocks out to every SSE subscriber.
+# "changestream" needs a replica set or sharded cluster, "poll" reads new blocks
+# by _id, "auto" tries a change stream and falls back to polling.
+FEED_SOURCE = os.environ.get('FEED_SOURCE', 'auto').lower()
+FEED_POLL_INTERVAL = float(os.environ.get('FEED_POLL_INTERVAL', '1'))
+FEED_POLL_BATCH = int(os.environ.get('FEED_POLL_BATCH', '500'))
+FEED_QUEUE_SIZE = int(os.environ.get('FEED_QUEUE_SIZE', '256'))
+FEED_HEARTBEAT_SECONDS = float(os.environ.get('FEED_HEARTBEAT_SECONDS', '15'))
+FEED_MAX_SUBSCRIBERS = int(os.environ.get('FEED_MAX_SUBSCRIBERS', '10000'))
+
+class FeedSubscriber:
+    __slots__ = ("queue", "batch_id", "herb_type", "status")
+
+    def __init__(self, batch_id: Optional[str], herb_type: Optional[str], status: Optional[str]):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=FEED_QUEUE_SIZE)
+        self.batch_id = batch_id
+        self.herb_type = herb_type
+        self.status = status
+
+class EventFeed:
+    """Fan-out of newly stored blocks to filtered subscribers.
+
+    Each block is serialized once and the same SSE frame is queued for every
+    matching subscriber, so an idle subscriber costs one queue and one parked
+    coroutine. A subscriber that falls FEED_QUEUE_SIZE frames behind is
+    disconnected; EventSource clients reconnect on their own.
+    """
+
+    def __init__(self):
+        self._by_batch: Dict[str, set] = {}
+        self._unscoped: set = set()
+        self._task: Optional[asyncio.Task] = None
+        self.source: Optional[str] = None
+        self.delivered = 0
+        self.dropped_subscribers = 0
+
+    def subscriber_count(self) -> int:
+        return len(self._unscoped) + sum(len(subscribers) for subscribers in self._by_batch.values())
+
+    def subscribe(self, batch_id: Optional[str], herb_type: Optional[str], status: Optional[str]) -> FeedSubscriber:
+        subscriber = FeedSubscriber(batch_id, herb_type, status)
+        if batch_id:
+            self._by_batch.setdefault(batch_id, set()).add(subscriber)
+        else:
+            self._unscoped.add(subscriber)
+        if self._task is None or self._task.done():
+            self._task = create_background_task(self._run())
+        return subscriber
+
+    def unsubscribe(self, subscriber: FeedSubscriber):
+        if subscriber.batch_id:
+            subscribers = self._by_batch.get(subscriber.batch_id, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._by_batch.pop(subscriber.batch_id, None)
+        else:
+            self._unscoped.discard(subscriber)
+        # Nobody left to listen: stop reading upstream until the next subscriber
+        if not self.subscriber_count() and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def publish(self, blocks: List[dict]):
+        """Queue each block for the subscribers whose filters it matches"""
+        matches = []
+        for block in blocks:
+            candidates = list(self._unscoped) + list(self._by_batch.get(block["batch_id"], ()))
+            if candidates:
+                matches.append((block, candidates))
+        if not matches:
+            return
+        
+        # Herb type and status live on the batch: one lookup, only if someone filters on them
+        batches: Dict[str, dict] = {}
+        if any(s.herb_type or s.status for _, candidates in matches for s in candidates):
+            async for batch in db.herb_batches.find(
+                {"id": {"$in": list({block["batch_id"] for block, _ in matches})}},
+                {"_id": 0, "id": 1, "herb_type": 1, "current_status": 1}
+            ):
+                batches[batch["id"]] = batch
+        
+        for block, candidates in matches:
+            block = {key: value for key, value in block.items() if key != "_id"}
+            frame = f"id: {block['id']}\nevent: block\ndata: {json.dumps(block, default=jsonable_encoder)}\n\n"
+            batch = batches.get(block["batch_id"], {})
+            for subscriber in candidates:
+                if subscriber.herb_type and batch.get("herb_type") != subscriber.herb_type:
+                    continue
+                if subscriber.status and batch.get("current_status") != subscriber.status:
+                    continue
+                try:
+                    subscriber.queue.put_nowait(frame)
+                    self.delivered += 1
+                except asyncio.QueueFull:
+                    self._drop(subscriber)
+
+    def _drop(self, subscriber: FeedSubscriber):
+        self.unsubscribe(subscriber)
+        self.dropped_subscribers += 1
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+    async def _run(self):
+        if FEED_SOURCE != 'poll':
+            try:
+                self.source = "changestream"
+                await self._watch()
+                return
+            except OperationFailure as e:
+                if FEED_SOURCE == 'changestream':
+                    raise
+                logger.info(f"Change streams unavailable, polling for new blocks instead: {e}")
+        self.source = "poll"
+        await self._poll()
+
+    async def _watch(self):
+        resume_token = None
+        started = False
+        while True:
+            try:
+                async with db.blockchain_events.watch(
+                    [{"$match": {"operationType": "insert"}}], resume_after=resume_token
+                ) as stream:
+                    started = True
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        await self.publish([change["fullDocument"]])
+            except OperationFailure:
+                # Before the first event this means change streams are unsupported
+                if not started:
+                    raise
+                logger.warning("Change stream failed, resuming")
+                await asyncio.sleep(FEED_POLL_INTERVAL)
+            except PyMongoError as e:
+                logger.warning(f"Change stream interrupted, resuming: {e}")
+                await asyncio.sleep(FEED_POLL_INTERVAL)
+
+    async def _poll(self):
+        # ObjectIds only increase per writer process, so with several writers a
+        # block can arrive slightly out of _id order and be missed by this cursor
+        latest = await db.blockchain_events.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        last_id = latest["_id"] if latest else ObjectId.from_datetime(datetime.now(timezone.utc))
+        while True:
+            try:
+                blocks = await db.blockchain_events.find({"_id": {"$gt": last_id}}).sort("_id", ASCENDING).to_list(FEED_POLL_BATCH)
+                if blocks:
+                    last_id = blocks[-1]["_id"]
+                    await self.publish(blocks)
+                if len(blocks) < FEED_POLL_BATCH:
+                    await asyncio.sleep(FEED_POLL_INTERVAL)
+            except PyMongoError as e:
+                logger.warning(f"Polling for new blocks failed, retrying: {e}")
+                await asyncio.sleep(FEED_POLL_INTERVAL)
+
+    def stats(self) -> dict:
+        return {
+            "source": self.source,
+            "subscribers": self.subscriber_count(),
+            "delivered": self.delivered,
+            "dropped_subscribers": self.dropped_subscribers
+        }
+
+event_feed = EventFeed()
+
+# API Routes
+@api_router.get("/")
+async def root():
+    return {"message": "Ayurvedic Herb Traceability Platform API"}
+
+async def create_herb_batch(collection_event: CollectionEvent) -> HerbBatch:
+    """Create a batch from its collection event: genesis block, collection document and batch"""
+    batch_number = f"BATCH-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8].upper()}"
+    herb_batch = HerbBatch(
+        batch_number=batch_number,
+        herb_type=collection_event.herb_type,
+        total_quantity_kg=collection_event.quantity_kg,
+        origin_location=collection_event.location
+    )
+    
+    # A new batch always starts from the genesis block
+    await chain_tail_cache.set(herb_batch.id, ("genesis", 0))
+    
+    # Genesis block, collection document and batch are written together
+    collection_dict = to_document(collection_event)
+    
+    async def write_batch(appended: Dict[str, List[BlockchainEvent]], session):
+        nonlocal herb_batch, batch_dict
+        if WRITE_STAGE_COLLECTIONS:
+            await db.collection_events.insert_one(storage_document(collection_dict), session=session)
+        herb_batch = herb_batch.model_copy(update=batch_summary(appended[herb_batch.id][-1]))
+        batch_dict = prepare_for_mongo(herb_batch.dict())
+        batch_dict["search"] = batch_search_fields(batch_dict["origin_location"], search_names(collection_dict))
+        await db.herb_batches.insert_one(batch_dict, session=session)
+    
+    batch_dict = None
+    if INGEST_MODE == 'journal':
+        batch_dict = prepare_for_mongo(herb_batch.dict())
+        batch_dict["search"] = batch_search_fields(batch_dict["origin_location"], search_names(collection_dict))
+        appended = await event_journal.append(
+            {herb_batch.id: [(EventType.COLLECTION, collection_dict)]}, {}, {herb_batch.id: batch_dict}
+        )
+        herb_batch = herb_batch.model_copy(update=batch_summary(appended[herb_batch.id][-1]))
+    else:
+        await append_blockchain_events({herb_batch.id: [(EventType.COLLECTION, collection_dict)]}, write_batch)
+        await record_stats(merge_increments(
+            batch_stats_increments(batch_dict),
+            event_stats_increments(EventType.COLLECTION)
+        ))
+    return herb_batch
+
+@api_router.post("/collection")
+async def create_collection_event(input: CollectionEventCreate, background_tasks: BackgroundTasks):
+    """Record a new herb collection event and create a batch"""
+    try:
+        herb_batch = await create_herb_batch(CollectionEvent(**input.dict()))
+        
+        # Pre-render the QR code label once the response has been sent
+        background_tasks.add_task(qr_cache.render, qr_scan_url(herb_batch.id))
+        
+        # Return the batch with properly serialized data using jsonable_encoder
+        return jsonable_encoder(herb_batch)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def add_stage_event_route(event_type: EventType, spec: StageEventSpec):
+    """Register POST /api/<event type> for a stage in the registry"""
+    async def add_stage_event(input: spec.create_model):
+        try:
+            stage_event = spec.event_model(**input.dict(exclude={"batch_id"}))
+            result = (await append_stage_events([(event_type, input.batch_id, stage_event)]))[0]
+            if isinstance(result, str):
+                raise HTTPException(status_code=404, detail=result)
+            
+            return {"message": f"{event_type.value.capitalize()} event added successfully", "event_id": stage_event.id}
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    add_stage_event.__name__ = f"add_{event_type.value}_event"
+    add_stage_event.__doc__ = spec.description
+    api_router.post(f"/{event_type.value}")(add_stage_event)
+
+for stage_event_type, stage_spec in STAGE_EVENTS.items():
+    add_stage_event_route(stage_event_type, stage_spec)
+
+@api_router.post("/events/bulk")
+async def add_events_bulk(input: BulkEventsRequest, background_tasks: BackgroundTasks):
+    """Add a mixed list of stage events across many batches in a handful of round trips.
+
+    Collection items create a new batch each and report its id; they cannot be
+    referenced by other items of the same request.
+    """
+    if len(input.events) > BULK_EVENTS_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_EVENTS_MAX} events per request")
+    try:
+        results: List[Optional[dict]] = [None] * len(input.events)
+
+        # Validate every item up front; invalid items are reported, not fatal
+        staged = []
+        collections = []
+        for index, item in enumerate(input.events):
+            if item.event_type == EventType.COLLECTION:
+                try:
+                    collection_fields = CollectionEventCreate(**item.data).dict()
+                    if item.event_date:
+                        collection_fields["collection_date"] = item.event_date
+                    collections.append((index, CollectionEvent(**collection_fields)))
+                except ValidationError as e:
+                    results[index] = {"index": index, "status": "error", "error": str(e)}
+                continue
+            spec = STAGE_EVENTS.get(item.event_type)
+            if spec is None:
+                results[index] = {"index": index, "status": "error", "error": f"Unsupported event type: {item.event_type.value}"}
+                continue
+            try:
+                event_input = spec.create_model(**item.data)
+                event_fields = event_input.dict(exclude={"batch_id"})
+                if item.event_date:
+                    event_fields[spec.date_field] = item.event_date
+                stage_event = spec.event_model(**event_fields)
+            except ValidationError as e:
+                results[index] = {"index": index, "status": "error", "error": str(e)}
+                continue
+            staged.append((index, item.event_type, event_input.batch_id, stage_event))
+
+        # Blocks, stage documents and batch updates for every valid item in three bulk writes
+        appended = await append_stage_events([
+            (event_type, batch_id, stage_event) for _, event_type, batch_id, stage_event in staged
+        ]) if staged else []
+
+        created = 0
+        for (index, _, batch_id, stage_event), blockchain_event in zip(staged, appended):
+            if isinstance(blockchain_event, str):
+                results[index] = {"index": index, "status": "error", "batch_id": batch_id, "error": blockchain_event}
+                continue
+            results[index] = {
+                "index": index,
+                "status": "created",
+                "batch_id": batch_id,
+                "event_id": stage_event.id,
+                "block_number": blockchain_event.block_number,
+                "hash": blockchain_event.hash
+            }
+            created += 1
+
+        # Each collection item starts its own chain with a genesis block
+        for index, collection_event in collections:
+            try:
+                herb_batch = await create_herb_batch(collection_event)
+            except Exception as e:
+                results[index] = {"index": index, "status": "error", "error": str(e)}
+                continue
+            background_tasks.add_task(qr_cache.render, qr_scan_url(herb_batch.id))
+            results[index] = {
+                "index": index,
+                "status": "created",
+                "batch_id": herb_batch.id,
+                "event_id": collection_event.id,
+                "block_number": herb_batch.last_block_number,
+                "hash": herb_batch.tail_hash
+            }
+            created += 1
+
+        return {
+            "message": f"{created} of {len(results)} events added successfully",
+            "created": created,
+            "failed": len(results) - created,
+            "results": results
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@api_router.get("/batch/{batch_id}")
+async def get_batch(batch_id: str, request: Request):
+    """Get batch details"""
+    async def build():
+        batch = await db.herb_batches.find_one({"id": batch_id}, {"_id": 0, "blockchain_events": 0})
+        if not batch:
+            raise HTTPException(status_code=404, detail="Batch not found")
+        
+        batch = parse_from_mongo(batch)
+        event_ids = [
+            event["id"] async for event in
+            db.blockchain_events.find({"batch_id": batch_id}, {"_id": 0, "id": 1}).sort("block_number", 1)
+        ]
+        return {**jsonable_encoder(HerbBatch(**batch)), "blockchain_events": event_ids}
+    
+    return await cached_json_response(request, batch_id, "batch", build)
+
+@api_router.get("/batch/{batch_id}/provenance")
+async def get_batch_provenance(batch_id: str, request: Request):
+    """Get complete provenance chain for a batch"""
+    async def build():
+        # Get the batch and all its blockchain events in one round trip
+        batch, events = await fetch_provenance(batch_id)
         if not batch:
             raise HTTPException(status_code=404, detail="Batch not found")
         
-        # Create QR code URL
-        qr_url = f"{os.environ.get('FRONTEND_URL', 'https://app.example.com')}/scan/{batch_id}"
+        # Verify blockchain integrity by recomputing every hash
+        report = await verify_chain(batch_id, events)
+        if not report["verified"]:
+            raise HTTPException(status_code=400, detail=f"Blockchain integrity compromised at block {report['first_invalid_block']}")
         
-        # Generate QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(qr_url)
-        qr.make(fit=True)
+        # Parse events
+        parsed_events = [parse_from_mongo(event) for event in events]
         
-        # Create image
-        img = qr.make_image(fill_color="black", back_color="white")
+        result = {
+            "batch": parse_from_mongo(batch),
+            "provenance_chain": parsed_events,
+            "chain_verified": True,
+            "total_events": len(parsed_events)
+        }
+        return jsonable_encoder(result)
+    
+    try:
+        return await cached_json_response(request, batch_id, "provenance", build)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.get("/batch/{batch_id}/verify")
+async def verify_batch_chain(batch_id: str):
+    """Recompute every block hash of a batch and report the first bad block"""
+    try:
+        events = await db.blockchain_events.find(
+            {"batch_id": batch_id}, {"_id": 0}
+        ).sort("block_number", 1).to_list(length=None)
+        if not events and not await db.herb_batches.find_one({"id": batch_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Batch not found")
         
-        # Save to bytes buffer
-        img_buffer = io.BytesIO()
-        img.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
+        report = await verify_chain(batch_id, events)
+        return {"batch_id": batch_id, "tail_hash": events[-1]["hash"] if events else None, **report}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.post("/audit")
+async def start_audit(resume_job_id: Optional[str] = Query(None)):
+    """Start a platform-wide chain audit in the background"""
+    try:
+        job = await start_chain_audit(resume_job_id)
+        return job.progress()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.get("/audit/{job_id}")
+async def get_audit_progress(job_id: str):
+    """Get progress of a chain audit, live while it runs on this server"""
+    job = audit_jobs.get(job_id)
+    if job:
+        return job.progress()
+    state = await db.audit_jobs.find_one({"_id": job_id})
+    if not state:
+        raise HTTPException(status_code=404, detail="Audit job not found")
+    return ChainAuditJob(state=state).progress()
+
+@api_router.get("/scan/{batch_id}")
+async def get_scan_summary(batch_id: str, request: Request):
+    """Compact provenance summary for consumer QR scans"""
+    async def build():
+        batch, blocks = await fetch_provenance(batch_id)
+        if not batch:
+            raise HTTPException(status_code=404, detail="Batch not found")
         
-        return StreamingResponse(img_buffer, media_type="image/png")
+        report = await verify_chain(batch_id, blocks)
+        return jsonable_encoder(scan_summary(batch, blocks, report))
+    
+    return await cached_json_response(request, batch_id, "scan", build)
+
+@api_router.post("/anchors")
+async def create_anchor():
+    """Anchor all blocks added since the last anchor right away"""
+    try:
+        anchors = []
+        while anchor := await anchor_pending_blocks():
+            anchors.append({key: value for key, value in anchor.items() if key != "leaves"})
+        return {"message": f"{len(anchors)} anchors created", "anchors": anchors}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@api_router.get("/qr/{batch_id}/base64")
-async def generate_qr_base64(batch_id: str):
-    """Generate QR code as base64 string"""
+@api_router.get("/proof/{event_id}")
+async def get_inclusion_proof(event_id: str):
+    """Get a Merkle inclusion proof for a block, verifiable offline against the anchor root"""
     try:
-        batch = await db.herb_batches.find_one({"id": batch_id}, {"_id": 0})
+        # Accept either the blockchain event id or the stage event id returned by the write endpoints
+        event = await db.blockchain_events.find_one(
+            {"$or": [{"id": event_id}, {"event_data.id": event_id}]},
+            {"_id": 0, "id": 1, "batch_id": 1, "block_number": 1, "hash": 1, "anchor_id": 1, "anchor_index": 1}
+        )
+        if not event:
+            raise HTTPException(status_code=404, detail="Event not found")
+        if not event.get("anchor_id"):
+            raise HTTPException(status_code=404, detail="Event not anchored yet")
+        
+        anchor = await db.merkle_anchors.find_one({"id": event["anchor_id"]}, {"_id": 0})
+        levels = anchor_levels_cache.get(anchor["id"])
+        if levels is None:
+            levels = merkle_levels(anchor["leaves"])
+            anchor_levels_cache.set(anchor["id"], levels)
+        
+        return {
+            "event_id": event["id"],
+            "batch_id": event["batch_id"],
+            "block_number": event["block_number"],
+            "block_hash": event["hash"],
+            "leaf_index": event["anchor_index"],
+            "proof": merkle_proof(levels, event["anchor_index"]),
+            "anchor": {key: value for key, value in anchor.items() if key != "leaves"},
+            "algorithm": MERKLE_ALGORITHM
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.get("/feed/events")
+async def stream_events(
+    batch_id: Optional[str] = Query(None),
+    herb_type: Optional[str] = Query(None),
+    status: Optional[str] = Query(None),
+):
+    """Server-sent events stream of new blocks, optionally filtered by batch, herb type or status"""
+    if event_feed.subscriber_count() >= FEED_MAX_SUBSCRIBERS:
+        raise HTTPException(status_code=503, detail="Too many feed subscribers")
+    
+    async def frames():
+        # Subscribe only once streaming starts: a client gone before then never
+        # runs this generator, so its subscription could not be cleaned up
+        subscriber = event_feed.subscribe(batch_id, herb_type, status)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    frame = await asyncio.wait_for(subscriber.queue.get(), FEED_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                if frame is None:
+                    return
+                yield frame
+        finally:
+            event_feed.unsubscribe(subscriber)
+    
+    return StreamingResponse(
+        frames(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/batches")
+async def get_all_batches(
+    limit: int = Query(BATCH_PAGE_DEFAULT, ge=1, le=BATCH_PAGE_MAX),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
+):
+    """Get herb batches, newest first; the next page's cursor is in X-Next-Cursor"""
+    batches, next_cursor = await find_batch_page({}, limit, cursor, fields)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return JSONResponse(jsonable_encoder(batches), headers=headers)
+
+@api_router.get("/qr/{batch_id}")
+async def generate_qr_info(batch_id: str, request: Request):
+    """Generate QR code information for a batch"""
+    async def build():
+        batch = await db.herb_batches.find_one({"id": batch_id}, {"_id": 0, "batch_number": 1, "herb_type": 1})
         if not batch:
             raise HTTPException(status_code=404, detail="Batch not found")
         
-        # Create QR code URL
-        qr_url = f"{os.environ.get('FRONTEND_URL', 'https://app.example.com')}/scan/{batch_id}"
+        # QR code data
+        qr_data = {
+            "batch_id": batch_id,
+            "batch_number": batch["batch_number"],
+            "herb_type": batch["herb_type"],
+            "scan_url": f"/scan/{batch_id}",
+            "verification_hash": hashlib.sha256(f"{batch_id}{batch['batch_number']}".encode()).hexdigest()[:16]
+        }
         
-        # Generate QR code
-        qr = qrcode.QRCode(version=1, box_size=10, border=4)
-        qr.add_data(qr_url)
-        qr.make(fit=True)
+        return jsonable_encoder(qr_data)
+    
+    return await cached_json_response(request, batch_id, "qr", build)
+
+
+@api_router.get("/qr/{batch_id}/image")
+async def generate_qr_image(batch_id: str, request: Request):
+    """Generate actual QR code image for a batch"""
+    try:
+        etag = qr_cache.key(qr_scan_url(batch_id))
+        headers = {"ETag": f'"{etag}"', "Cache-Control": "public, max-age=86400"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            # The ETag only depends on the id, so revalidations still need the batch to exist
+            if not await db.herb_batches.find_one({"id": batch_id}, {"_id": 1}):
+                raise HTTPException(status_code=404, detail="Batch not found")
+            return Response(status_code=304, headers=headers)
+        
+        qr_png = await get_batch_qr_png(batch_id)
+        if not qr_png:
+            raise HTTPException(status_code=404, detail="Batch not found")
         
-        img = qr.make_image(fill_color="black", back_color="white")
+        return Response(content=qr_png[1], media_type="image/png", headers=headers)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.get("/qr/{batch_id}/base64")
+async def generate_qr_base64(batch_id: str):
+    """Generate QR code as base64 string"""
+    try:
+        qr_png = await get_batch_qr_png(batch_id)
+        if not qr_png:
+            raise HTTPException(status_code=404, detail="Batch not found")
         
-        # Convert to base64
-        img_buffer = io.BytesIO()
-        img.save(img_buffer, format='PNG')
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
+        img_base64 = base64.b64encode(qr_png[1]).decode()
         
         return {
             "batch_id": batch_id,
             "qr_code_base64": f"data:image/png;base64,{img_base64}",
-            "scan_url": qr_url
+            "scan_url": qr_scan_url(batch_id)
         }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.post("/qr/labels")
+async def generate_qr_labels(input: QRLabelRequest):
+    """Generate QR labels for many batches as a printable PDF or a ZIP of PNGs"""
+    try:
+        if input.batch_ids:
+            query = {"id": {"$in": input.batch_ids}}
+        elif input.filters:
+            query = build_batch_search_query(**input.filters.dict())
+        else:
+            raise HTTPException(status_code=400, detail="Provide batch_ids or filters")
+        
+        if input.format == LabelFormat.ZIP:
+            return StreamingResponse(
+                stream_qr_label_zip(query),
+                media_type="application/zip",
+                headers={"Content-Disposition": "attachment; filename=qr_labels.zip"}
+            )
+        
+        pdf_file = await build_qr_label_pdf(query)
+        return StreamingResponse(
+            iter_file_chunks(pdf_file),
+            media_type="application/pdf",
+            headers={"Content-Disposition": "attachment; filename=qr_labels.pdf"}
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -729,49 +3471,22 @@ async def search_batches(
     max_quantity: Optional[float] = Query(None),
     district: Optional[str] = Query(None),
     state: Optional[str] = Query(None),
+    q: Optional[str] = Query(None),
+    limit: int = Query(BATCH_PAGE_DEFAULT, ge=1, le=BATCH_PAGE_MAX),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
 ):
-    """Advanced search and filter for batches"""
+    """Advanced search and filter for batches; q ranks results by text relevance"""
     try:
-        # Build query
-        query = {}
-        
-        if herb_type:
-            query["herb_type"] = herb_type
-        
-        if status:
-            query["current_status"] = status
-        
-        if from_date or to_date:
-            date_query = {}
-            if from_date:
-                date_query["$gte"] = from_date
-            if to_date:
-                date_query["$lte"] = to_date
-            if date_query:
-                query["created_date"] = date_query
-        
-        if min_quantity is not None or max_quantity is not None:
-            quantity_query = {}
-            if min_quantity is not None:
-                quantity_query["$gte"] = min_quantity
-            if max_quantity is not None:
-                quantity_query["$lte"] = max_quantity
-            if quantity_query:
-                query["total_quantity_kg"] = quantity_query
-        
-        if district:
-            query["origin_location.district"] = {"$regex": district, "$options": "i"}
-        
-        if state:
-            query["origin_location.state"] = {"$regex": state, "$options": "i"}
-        
-        # Execute search
-        batches = await db.herb_batches.find(query, {"_id": 0}).to_list(1000)
-        parsed_batches = [parse_from_mongo(batch) for batch in batches]
+        query = build_batch_search_query(
+            herb_type, status, from_date, to_date, min_quantity, max_quantity, district, state, q
+        )
+        batches, next_cursor = await find_batch_page(query, limit, cursor, fields)
         
         return {
-            "total_results": len(parsed_batches),
-            "batches": jsonable_encoder([HerbBatch(**batch) for batch in parsed_batches])
+            "total_results": len(batches),
+            "batches": jsonable_encoder(batches),
+            "next_cursor": next_cursor
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -780,108 +3495,68 @@ async def search_batches(
 async def get_analytics_overview():
     """Get comprehensive analytics for the platform"""
     try:
-        # Get all batches
-        batches = await db.herb_batches.find({}, {"_id": 0}).to_list(10000)
-        
-        # Calculate statistics
-        total_batches = len(batches)
-        total_quantity = sum(batch.get("total_quantity_kg", 0) for batch in batches)
-        
-        # Herb type distribution
-        herb_distribution = {}
-        for batch in batches:
-            herb_type = batch.get("herb_type", "unknown")
-            herb_distribution[herb_type] = herb_distribution.get(herb_type, 0) + 1
-        
-        # Status distribution
-        status_distribution = {}
-        for batch in batches:
-            status = batch.get("current_status", "unknown")
-            status_distribution[status] = status_distribution.get(status, 0) + 1
-        
-        # Location distribution
-        location_distribution = {}
-        for batch in batches:
-            location = batch.get("origin_location", {})
-            state = location.get("state", "Unknown")
-            location_distribution[state] = location_distribution.get(state, 0) + 1
-        
-        # Blockchain events count
-        total_events = await db.blockchain_events.count_documents({})
+        # Counters are maintained by the write paths; build them once if missing
+        stats = await db.platform_stats.find_one({"_id": STATS_ID})
+        if not stats:
+            stats = await rebuild_stats()
         
-        # Events by type
-        event_types = ["collection", "processing", "testing", "packaging", "distribution", "retail"]
-        events_by_type = {}
-        for event_type in event_types:
-            count = await db.blockchain_events.count_documents({"event_type": event_type})
-            events_by_type[event_type] = count
+        total_batches = stats.get("total_batches", 0)
+        total_events = stats.get("total_events", 0)
+        events = stats.get("events", {})
+        monthly = stats.get("monthly", {})
         
         # Monthly batch creation trend (last 12 months)
         monthly_trend = []
-        for i in range(12):
-            month_start = datetime.now(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            month_start = month_start.replace(month=month_start.month - i if month_start.month > i else 12 + month_start.month - i)
-            
-            # Count batches created in this month
-            count = sum(1 for batch in batches 
-                       if isinstance(batch.get("created_date"), str) and 
-                       batch.get("created_date", "").startswith(month_start.strftime("%Y-%m")))
-            
-            monthly_trend.insert(0, {
-                "month": month_start.strftime("%Y-%m"),
-                "count": count
-            })
+        now = datetime.now(timezone.utc)
+        for i in range(11, -1, -1):
+            year, month = divmod(now.year * 12 + now.month - 1 - i, 12)
+            key = f"{year:04d}-{month + 1:02d}"
+            monthly_trend.append({"month": key, "count": monthly.get(key, 0)})
         
         return {
             "overview": {
                 "total_batches": total_batches,
-                "total_quantity_kg": round(total_quantity, 2),
+                "total_quantity_kg": round(stats.get("total_quantity_kg", 0), 2),
                 "total_blockchain_events": total_events,
                 "average_events_per_batch": round(total_events / total_batches, 2) if total_batches > 0 else 0
             },
-            "herb_distribution": herb_distribution,
-            "status_distribution": status_distribution,
-            "location_distribution": location_distribution,
-            "events_by_type": events_by_type,
+            "herb_distribution": {k: v for k, v in stats.get("herb", {}).items() if v > 0},
+            "status_distribution": {k: v for k, v in stats.get("status", {}).items() if v > 0},
+            "location_distribution": {k: v for k, v in stats.get("location", {}).items() if v > 0},
+            "events_by_type": {event_type.value: events.get(event_type.value, 0) for event_type in EventType},
             "monthly_trend": monthly_trend
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@api_router.post("/analytics/rebuild")
+async def rebuild_analytics():
+    """Recompute the materialized analytics counters from scratch"""
+    try:
+        stats = await rebuild_stats()
+        return {"message": "Analytics rebuilt successfully", "rebuilt_at": stats["rebuilt_at"]}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @api_router.get("/export/batches/csv")
-async def export_batches_csv():
-    """Export all batches to CSV format"""
+async def export_batches_csv(
+    herb_type: Optional[str] = Query(None),
+    status: Optional[str] = Query(None),
+    from_date: Optional[str] = Query(None),
+    to_date: Optional[str] = Query(None),
+    min_quantity: Optional[float] = Query(None),
+    max_quantity: Optional[float] = Query(None),
+    district: Optional[str] = Query(None),
+    state: Optional[str] = Query(None),
+    q: Optional[str] = Query(None),
+):
+    """Export batches to CSV format, streamed straight from the database cursor"""
     try:
-        batches = await db.herb_batches.find({}, {"_id": 0}).to_list(10000)
-        
-        # Create CSV in memory
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow([
-            "Batch Number", "Herb Type", "Quantity (kg)", "Status", 
-            "Created Date", "District", "State", "Blockchain Events"
-        ])
-        
-        # Write data
-        for batch in batches:
-            location = batch.get("origin_location", {})
-            writer.writerow([
-                batch.get("batch_number", ""),
-                batch.get("herb_type", ""),
-                batch.get("total_quantity_kg", 0),
-                batch.get("current_status", ""),
-                batch.get("created_date", ""),
-                location.get("district", ""),
-                location.get("state", ""),
-                len(batch.get("blockchain_events", []))
-            ])
-        
-        # Prepare response
-        output.seek(0)
+        query = build_batch_search_query(
+            herb_type, status, from_date, to_date, min_quantity, max_quantity, district, state, q
+        )
         return StreamingResponse(
-            iter([output.getvalue()]),
+            stream_batches_csv(query),
             media_type="text/csv",
             headers={"Content-Disposition": "attachment; filename=herb_batches.csv"}
         )
@@ -889,26 +3564,26 @@ async def export_batches_csv():
         raise HTTPException(status_code=400, detail=str(e))
 
 @api_router.get("/export/batch/{batch_id}/json")
-async def export_batch_json(batch_id: str):
+async def export_batch_json(batch_id: str, request: Request):
     """Export single batch with full provenance as JSON"""
-    try:
-        # Get batch
-        batch = await db.herb_batches.find_one({"id": batch_id}, {"_id": 0})
+    async def build():
+        # Get the batch with all its events
+        batch, events = await fetch_provenance(batch_id)
         if not batch:
             raise HTTPException(status_code=404, detail="Batch not found")
         
-        # Get all events
-        events = await db.blockchain_events.find(
-            {"batch_id": batch_id}, {"_id": 0}
-        ).sort("block_number", 1).to_list(length=None)
-        
         export_data = {
             "batch": batch,
             "blockchain_events": events,
             "export_date": datetime.now(timezone.utc).isoformat()
         }
         
-        return export_data
+        return jsonable_encoder(export_data)
+    
+    try:
+        return await cached_json_response(request, batch_id, "export", build)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -916,88 +3591,50 @@ async def export_batch_json(batch_id: str):
 async def export_batch_pdf(batch_id: str):
     """Generate PDF report for a batch"""
     try:
-        # Get batch with provenance
-        batch = await db.herb_batches.find_one({"id": batch_id}, {"_id": 0})
-        if not batch:
+        pdf_bytes = await get_batch_pdf(batch_id)
+        if pdf_bytes is None:
             raise HTTPException(status_code=404, detail="Batch not found")
         
-        events = await db.blockchain_events.find(
-            {"batch_id": batch_id}, {"_id": 0}
-        ).sort("block_number", 1).to_list(length=None)
-        
-        # Create PDF
-        pdf_buffer = io.BytesIO()
-        doc = SimpleDocTemplate(pdf_buffer, pagesize=A4)
-        story = []
-        styles = getSampleStyleSheet()
-        
-        # Title
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=colors.HexColor('#2E7D32'),
-            spaceAfter=30,
-        )
-        story.append(Paragraph("Ayurvedic Herb Traceability Report", title_style))
-        story.append(Spacer(1, 0.2*inch))
-        
-        # Batch Information
-        story.append(Paragraph("<b>Batch Information</b>", styles['Heading2']))
-        batch_data = [
-            ["Batch Number:", batch.get("batch_number", "N/A")],
-            ["Herb Type:", batch.get("herb_type", "N/A").capitalize()],
-            ["Quantity:", f"{batch.get('total_quantity_kg', 0)} kg"],
-            ["Status:", batch.get("current_status", "N/A").capitalize()],
-            ["Created Date:", str(batch.get("created_date", "N/A"))[:10]],
-        ]
-        batch_table = Table(batch_data, colWidths=[2*inch, 4*inch])
-        batch_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        story.append(batch_table)
-        story.append(Spacer(1, 0.3*inch))
-        
-        # Blockchain Events
-        story.append(Paragraph("<b>Blockchain Verified Events</b>", styles['Heading2']))
-        story.append(Paragraph(f"Total Events: {len(events)} | Chain Verified: ✓", styles['Normal']))
-        story.append(Spacer(1, 0.2*inch))
-        
-        for event in events:
-            event_data = [
-                ["Event Type:", event.get("event_type", "").capitalize()],
-                ["Block Number:", str(event.get("block_number", ""))],
-                ["Timestamp:", str(event.get("timestamp", ""))[:19]],
-                ["Hash:", event.get("hash", "")[:32] + "..."],
-            ]
-            event_table = Table(event_data, colWidths=[1.5*inch, 4.5*inch])
-            event_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-                ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, -1), 9),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
-            ]))
-            story.append(event_table)
-            story.append(Spacer(1, 0.15*inch))
-        
-        # Build PDF
-        doc.build(story)
-        pdf_buffer.seek(0)
-        
-        return StreamingResponse(
-            pdf_buffer,
+        return Response(
+            content=pdf_bytes,
             media_type="application/pdf",
             headers={"Content-Disposition": f"attachment; filename=batch_{batch_id}_report.pdf"}
         )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.get("/system/query-plans")
+async def get_query_plans():
+    """Report the winning plan of every built-in query shape"""
+    try:
+        reports = await explain_query_shapes()
+        return {
+            "queries": reports,
+            "collscans": [report["name"] for report in reports if report["collscan"]]
+        }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@api_router.get("/system/cache-stats")
+async def get_cache_stats():
+    """Get hit/miss counters of the in-process caches"""
+    return {
+        "chain_tail": chain_tail_cache.stats(),
+        "pdf": pdf_cache.stats(),
+        "qr": qr_cache.stats(),
+        "chain_verification": verification_cache.stats(),
+        "responses": response_cache.stats(),
+        "journal": event_journal.stats(),
+        "feed": event_feed.stats()
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -1008,7 +3645,10 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -1017,6 +3657,140 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_db_client():
+    if not await ensure_indexes():
+        # Without the index concurrent appends fork chains silently instead of retrying
+        raise RuntimeError(
+            "blockchain_events has no unique (batch_id, block_number) index; "
+            "run `python server.py check-chains --repair` before starting"
+        )
+    if not await db.platform_stats.find_one({"_id": STATS_ID}):
+        await rebuild_stats()
+    if MERKLE_ANCHOR_INTERVAL_SECONDS > 0:
+        global _anchor_task
+        _anchor_task = asyncio.create_task(merkle_anchor_loop())
+    if INGEST_MODE == 'journal':
+        global _journal_task
+        event_journal.open()
+        _journal_task = asyncio.create_task(event_journal.run())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    global _process_executor, _verify_executor
+    if _anchor_task is not None:
+        _anchor_task.cancel()
+    event_feed.stop()
+    if _journal_task is not None:
+        # Stop the background flusher, then drain what is left before closing
+        _journal_task.cancel()
+        try:
+            while await event_journal.flush():
+                pass
+        except Exception as e:
+            logger.error(f"Journal not fully flushed at shutdown, it will be replayed: {e}")
+        event_journal.close()
     client.close()
+    if _process_executor is not None:
+        _process_executor.shutdown(wait=False, cancel_futures=True)
+        _process_executor = None
+    if _verify_executor is not None:
+        _verify_executor.shutdown(wait=False)
+        _verify_executor = None
+
+
+async def check_indexes() -> int:
+    """CLI: create indexes, then fail if any built-in query still collection-scans"""
+    chain_index = await ensure_indexes()
+    if not chain_index:
+        print("blockchain_events is missing the unique (batch_id, block_number) index; run check-chains --repair")
+    reports = await explain_query_shapes()
+    for report in reports:
+        marker = "COLLSCAN" if report["collscan"] else "ok"
+        print(f"{report['name']:<24} {report['collection']:<20} {marker:<9} {' > '.join(report['stages'])}")
+    return 1 if not chain_index or any(report["collscan"] for report in reports) else 0
+
+async def check_chains_command(repair: bool = False) -> int:
+    """CLI: report batches with forked chains and optionally repair them"""
+    forks = await find_chain_forks()
+    for fork in forks:
+        print(f"FORK {fork['batch_id']} block {fork['block_number']}: {fork['count']} blocks")
+    if not forks:
+        print("No forked chains")
+    elif repair:
+        moved = await repair_chain_forks(sorted({fork["batch_id"] for fork in forks}))
+        await rebuild_stats()
+        print(f"Moved {moved} forked blocks to forked_blocks")
+    if not await ensure_indexes():
+        return 1
+    print("Unique chain index in place")
+    return 0 if repair or not forks else 1
+
+async def rebuild_stats_command() -> int:
+    """CLI: recompute the materialized analytics counters"""
+    stats = await rebuild_stats()
+    print(f"Rebuilt stats: {stats['total_batches']} batches, {stats['total_events']} events")
+    return 0
+
+async def migrate_dates_command(target: str = 'native') -> int:
+    """CLI: convert stored dates of batches and stage events to the target representation"""
+    for collection_name in DATE_MIGRATION_COLLECTIONS:
+        converted = await migrate_dates(collection_name, target)
+        print(f"{collection_name:<22} {converted} documents converted to {target} dates")
+    return 0
+
+async def migrate_batch_summaries_command() -> int:
+    """CLI: move batches from block id arrays to chain summaries"""
+    migrated = await migrate_batch_summaries()
+    print(f"{migrated} batches migrated to chain summaries")
+    return 0
+
+async def backfill_search_command(rebuild: bool = False) -> int:
+    """CLI: fill in the search fields used by /api/search/batches"""
+    updated = await backfill_batch_search(rebuild)
+    print(f"{updated} batches updated")
+    return 0
+
+async def audit_command(resume_job_id: Optional[str] = None) -> int:
+    """CLI: audit every chain in the foreground, printing progress"""
+    job = await start_chain_audit(resume_job_id)
+    print(f"Audit job {job.job_id}")
+    while job.state["status"] in ("pending", "running"):
+        await asyncio.sleep(2)
+        print(f"  {job.state['batches_checked']} batches, {job.state['blocks_checked']} blocks, "
+              f"{job.state['blocks_per_second']} blocks/sec, {job.state['broken_count']} broken")
+    for broken in job.state["broken_batches"]:
+        print(f"  BROKEN {broken['batch_id']} at block {broken['first_invalid_block']}: {broken['reason']}")
+    print(f"Audit {job.state['status']}")
+    return 0 if job.state["status"] == "completed" and not job.state["broken_count"] else 1
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Herb traceability maintenance commands")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("check-indexes", help="Create indexes and report queries still doing a COLLSCAN")
+    subcommands.add_parser("rebuild-stats", help="Recompute the materialized analytics counters")
+    chains_parser = subcommands.add_parser("check-chains", help="Report batches whose chains forked under concurrent appends")
+    chains_parser.add_argument("--repair", action="store_true", help="Keep one chain per batch and set the other blocks aside")
+    audit_parser = subcommands.add_parser("audit", help="Verify every batch chain")
+    audit_parser.add_argument("--resume", dest="resume_job_id", help="Resume an audit job from its checkpoint")
+    migrate_parser = subcommands.add_parser("migrate-dates", help="Convert stored dates between ISO strings and BSON datetimes")
+    migrate_parser.add_argument("--to", dest="target", choices=["native", "string"], default="native")
+    subcommands.add_parser("migrate-batch-summaries", help="Replace stored block id arrays with chain summaries")
+    search_parser = subcommands.add_parser("backfill-search", help="Fill in normalized search fields of older batches")
+    search_parser.add_argument("--rebuild", action="store_true", help="Recompute the fields of every batch")
+    args = parser.parse_args()
+
+    commands = {
+        "check-indexes": check_indexes,
+        "rebuild-stats": rebuild_stats_command,
+        "check-chains": check_chains_command,
+        "audit": audit_command,
+        "migrate-dates": migrate_dates_command,
+        "migrate-batch-summaries": migrate_batch_summaries_command,
+        "backfill-search": backfill_search_command,
+    }
+    options = {key: value for key, value in vars(args).items() if key != "command"}
+    sys.exit(asyncio.run(commands[args.command](**options)))
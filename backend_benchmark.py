@@ -0,0 +1,382 @@
+import argparse
+import asyncio
+import json
+import hashlib
+import os
+import requests
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+COLLECTION_PAYLOAD = {
+    "herb_type": "ashwagandha",
+    "quantity_kg": 25.5,
+    "location": {
+        "latitude": 15.3173,
+        "longitude": 75.7139,
+        "address": "Benchmark Farm Location",
+        "district": "Ballari",
+        "state": "Karnataka"
+    },
+    "collector_name": "Benchmark Collector",
+    "collector_id": "BENCH-001"
+}
+
+def latency_summary(latencies, elapsed):
+    """p50/p95/p99 in milliseconds and requests per second for one run"""
+    ordered = sorted(latencies)
+    summary = {"requests": len(ordered), "rps": round(len(ordered) / elapsed, 1) if elapsed else 0.0}
+    for label, quantile in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+        index = min(len(ordered) - 1, int(quantile * len(ordered)))
+        summary[f"{label}_ms"] = round(ordered[index] * 1000, 2) if ordered else None
+    return summary
+
+class HerbTraceabilityBenchmark:
+    def __init__(self, base_url="http://localhost:8001"):
+        self.base_url = base_url
+        self.api_url = f"{base_url}/api"
+        self.session = requests.Session()
+
+    def create_batch(self):
+        """Create a fresh batch to append events to"""
+        response = self.session.post(f"{self.api_url}/collection", json=COLLECTION_PAYLOAD, timeout=15)
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def append_event(self, batch_id, index):
+        """Append one processing or testing event, alternating like two stations would"""
+        if index % 2:
+            url = f"{self.api_url}/testing"
+            payload = {
+                "batch_id": batch_id,
+                "lab_name": "Benchmark Lab",
+                "test_results": [{
+                    "test_type": "moisture",
+                    "result_value": "8.5",
+                    "unit": "%",
+                    "pass_status": True,
+                    "lab_name": "Benchmark Lab"
+                }]
+            }
+        else:
+            url = f"{self.api_url}/processing"
+            payload = {
+                "batch_id": batch_id,
+                "processing_type": "drying",
+                "processor_name": f"Benchmark Processor {index}"
+            }
+        started = time.perf_counter()
+        response = requests.post(url, json=payload, timeout=30)
+        return response.status_code, time.perf_counter() - started
+
+    def stress_single_batch(self, appends, concurrency):
+        """Fire parallel appends at one batch and check the chain is still intact"""
+        batch_id = self.create_batch()
+        print(f"🔗 {appends} parallel appends to batch {batch_id} (concurrency {concurrency})")
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(lambda i: self.append_event(batch_id, i), range(appends)))
+        elapsed = time.perf_counter() - started
+
+        failures = sum(1 for status, _ in outcomes if status != 200)
+        provenance = self.session.get(f"{self.api_url}/batch/{batch_id}/provenance", timeout=60)
+        chain = provenance.json().get("provenance_chain", []) if provenance.status_code == 200 else []
+        block_numbers = [event["block_number"] for event in chain]
+        contiguous = block_numbers == list(range(1, appends - failures + 2))
+
+        print(f"   Throughput: {appends / elapsed:.1f} appends/sec")
+        print(f"   Failed appends: {failures}")
+        print(f"   Provenance status: {provenance.status_code}, blocks: {len(chain)}, contiguous: {contiguous}")
+        return provenance.status_code == 200 and failures == 0 and contiguous
+
+    def stress_many_batches(self, appends, concurrency):
+        """Spread the same number of parallel appends over separate batches for comparison"""
+        batch_ids = [self.create_batch() for _ in range(concurrency)]
+        print(f"🌿 {appends} parallel appends over {len(batch_ids)} batches (concurrency {concurrency})")
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(
+                lambda i: self.append_event(batch_ids[i % len(batch_ids)], i), range(appends)
+            ))
+        elapsed = time.perf_counter() - started
+
+        failures = sum(1 for status, _ in outcomes if status != 200)
+        print(f"   Throughput: {appends / elapsed:.1f} appends/sec")
+        print(f"   Failed appends: {failures}")
+        return failures == 0
+
+    def ingest_latency(self, appends, concurrency):
+        """Report append latency percentiles, e.g. to compare INGEST_MODE=sync with journal"""
+        batch_ids = [self.create_batch() for _ in range(concurrency)]
+        print(f"⏱️  Ingest latency: {appends} appends over {len(batch_ids)} batches (concurrency {concurrency})")
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(
+                lambda i: self.append_event(batch_ids[i % len(batch_ids)], i), range(appends)
+            ))
+        elapsed = time.perf_counter() - started
+
+        latencies = [seconds for status, seconds in outcomes if status == 200]
+        failures = appends - len(latencies)
+        summary = latency_summary(latencies, elapsed)
+        print(f"   p50: {summary['p50_ms']} ms, p95: {summary['p95_ms']} ms, p99: {summary['p99_ms']} ms")
+        print(f"   Throughput: {appends / elapsed:.1f} appends/sec")
+        print(f"   Failed appends: {failures}")
+        return failures == 0
+
+def import_server():
+    """Import backend/server.py in this process"""
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "herb_benchmark")
+    os.environ.setdefault("MERKLE_ANCHOR_INTERVAL_SECONDS", "0")
+    sys.path.insert(0, str(Path(__file__).parent / "backend"))
+    import server
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+    return server
+
+def hashing_microbenchmark(events=2000, repeat=5):
+    """Compare the per-event cost of the old double-dump hashing path with the canonical one.
+
+    Runs in-process against server.py's helpers; no running server or database is needed.
+    """
+    server = import_server()
+
+    stage_events = [
+        server.TestingEvent(
+            lab_name="Benchmark Lab",
+            test_results=[{
+                "test_type": "moisture",
+                "result_value": "8.5",
+                "unit": "%",
+                "pass_status": True,
+                "lab_name": "Benchmark Lab"
+            }]
+        )
+        for _ in range(events)
+    ]
+
+    def legacy_path(stage_event):
+        # What the handlers did before: dump and prepare the event once for the
+        # hash and once more for storage, validate the block, then dump it again
+        event_data = server.prepare_for_mongo(stage_event.dict())
+        block = server.BlockchainEvent(
+            batch_id="bench", event_type=server.EventType.TESTING, event_data=event_data,
+            previous_hash="genesis", block_number=1
+        )
+        block.hash = hashlib.sha256(json.dumps({
+            "event_data": event_data,
+            "previous_hash": "genesis",
+            "timestamp": block.timestamp.isoformat()
+        }, sort_keys=True).encode()).hexdigest()
+        stage_doc = server.prepare_for_mongo(stage_event.dict())
+        return server.prepare_for_mongo(block.dict()), stage_doc
+
+    def canonical_path(stage_event):
+        event_data = server.to_document(stage_event)
+        block = server.build_blockchain_event("bench", server.EventType.TESTING, event_data, "genesis", 0)
+        return server.block_document(block), event_data
+
+    # Both paths must hash the same bytes, or old chains would stop verifying
+    block, _ = canonical_path(stage_events[0])
+    legacy_bytes = json.dumps({
+        "event_data": block["event_data"],
+        "previous_hash": block["previous_hash"],
+        "timestamp": block["timestamp"]
+    }, sort_keys=True).encode()
+    compatible = legacy_bytes == server.block_hash_payload(block)
+
+    print(f"🧮 Hashing path microbenchmark ({events} events, best of {repeat})")
+    results = {}
+    for name, path in (("legacy", legacy_path), ("canonical", canonical_path)):
+        seconds = min(timeit.repeat(lambda: [path(e) for e in stage_events], number=1, repeat=repeat))
+        tracemalloc.start()
+        outputs = [path(e) for e in stage_events]
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del outputs
+        results[name] = seconds / events
+        print(f"   {name:>9}: {seconds / events * 1e6:.1f} µs/event, "
+              f"{retained / events:.0f} B/event retained, {peak / events:.0f} B/event peak")
+
+    print(f"   Speedup: {results['legacy'] / results['canonical']:.2f}x, byte-compatible: {compatible}")
+    return compatible
+
+def processing_payload(batch_id, index):
+    return {"batch_id": batch_id, "processing_type": "drying", "processor_name": f"Benchmark Processor {index}"}
+
+def suite_scenarios(batch_ids, events):
+    """(name, method, path builder, json body builder) for each endpoint group"""
+    pick = lambda i: batch_ids[i % len(batch_ids)]
+    return [
+        ("collection", "POST", lambda i: "/api/collection", lambda i: COLLECTION_PAYLOAD),
+        ("stage_event", "POST", lambda i: "/api/processing", lambda i: processing_payload(pick(i), i)),
+        ("bulk_events", "POST", lambda i: "/api/events/bulk", lambda i: {"events": [
+            {"event_type": "processing", "data": processing_payload(pick(i + n), n)} for n in range(events)
+        ]}),
+        ("batch", "GET", lambda i: f"/api/batch/{pick(i)}", None),
+        ("provenance", "GET", lambda i: f"/api/batch/{pick(i)}/provenance", None),
+        ("verify", "GET", lambda i: f"/api/batch/{pick(i)}/verify", None),
+        ("scan", "GET", lambda i: f"/api/scan/{pick(i)}", None),
+        ("batches", "GET", lambda i: "/api/batches?limit=50", None),
+        ("search", "GET", lambda i: "/api/search/batches?herb_type=ashwagandha&state=karnataka&limit=50", None),
+        ("analytics", "GET", lambda i: "/api/analytics/overview", None),
+        ("csv_export", "GET", lambda i: "/api/export/batches/csv", None),
+        ("json_export", "GET", lambda i: f"/api/export/batch/{pick(i)}/json", None),
+        ("pdf_export", "GET", lambda i: f"/api/export/batch/{pick(i)}/pdf", None),
+        ("qr_info", "GET", lambda i: f"/api/qr/{pick(i)}", None),
+        ("qr_image", "GET", lambda i: f"/api/qr/{pick(i)}/image", None),
+    ]
+
+async def run_scenario(client, method, path, body, requests_count, concurrency):
+    """Issue requests_count requests with at most concurrency in flight"""
+    latencies, errors = [], 0
+    next_index = iter(range(requests_count))
+
+    async def worker():
+        nonlocal errors
+        for i in next_index:
+            started = time.perf_counter()
+            response = await client.request(method, path(i), json=body(i) if body else None)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {**latency_summary(latencies, time.perf_counter() - started), "errors": errors}
+
+async def load_suite(batches=50, events=5, requests_count=200, concurrency=10, only=None):
+    """Drive the API in-process against an in-memory Mongo stand-in.
+
+    mongomock-motor runs every query synchronously on the event loop, so the
+    numbers measure the application's own cost (validation, hashing, encoding,
+    rendering) rather than a database; compare them between commits, not with
+    production.
+    """
+    import httpx
+    from mongomock_motor import AsyncMongoMockClient
+
+    server = import_server()
+    # The QR disk cache is built at import; point it away from backend/qr_cache
+    qr_cache_dir = tempfile.TemporaryDirectory(prefix="herb_benchmark_qr_")
+    server.qr_cache.directory = Path(qr_cache_dir.name)
+    server.client = AsyncMongoMockClient()
+    server.db = server.client[os.environ["DB_NAME"]]
+    await server.ensure_indexes()
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=120) as client:
+        print(f"🌱 Seeding {batches} batches with {events} events each")
+        batch_ids = []
+        for _ in range(batches):
+            response = await client.post("/api/collection", json=COLLECTION_PAYLOAD)
+            response.raise_for_status()
+            batch_ids.append(response.json()["id"])
+        for start in range(0, len(batch_ids), 20):
+            response = await client.post("/api/events/bulk", json={"events": [
+                {"event_type": "processing", "data": processing_payload(batch_id, n)}
+                for batch_id in batch_ids[start:start + 20] for n in range(events)
+            ]})
+            response.raise_for_status()
+
+        results = {}
+        print(f"{'scenario':>12} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for name, method, path, body in suite_scenarios(batch_ids, events):
+            if only and name not in only:
+                continue
+            result = await run_scenario(client, method, path, body, requests_count, concurrency)
+            results[name] = result
+            print(f"{name:>12} {result['rps']:>9} {result['p50_ms']:>9} {result['p95_ms']:>9} "
+                  f"{result['p99_ms']:>9} {result['errors']:>7}")
+    await server.shutdown_db_client()
+    qr_cache_dir.cleanup()
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_baseline(baseline, results, tolerance):
+    """Print per-scenario changes against a saved baseline; True if nothing regressed beyond tolerance"""
+    print(f"📈 Compared with baseline {baseline.get('commit') or ''} ({baseline.get('created')})")
+    clean = True
+    for name, result in results.items():
+        before = baseline["scenarios"].get(name)
+        if not before or not before["p95_ms"] or not before["rps"]:
+            continue
+        p95_change = result["p95_ms"] / before["p95_ms"] - 1
+        rps_change = result["rps"] / before["rps"] - 1
+        regressed = p95_change > tolerance or rps_change < -tolerance or result["errors"] > before["errors"]
+        clean = clean and not regressed
+        print(f"   {'❌' if regressed else '✅'} {name:>12}: p95 {p95_change:+.0%}, req/s {rps_change:+.0%}")
+    return clean
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent block append stress benchmark")
+    parser.add_argument("--base-url", default="http://localhost:8001")
+    parser.add_argument("--appends", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--hashing", action="store_true", help="Only run the in-process hashing microbenchmark")
+    parser.add_argument("--ingest", action="store_true", help="Only measure append latency percentiles")
+    parser.add_argument("--suite", action="store_true", help="Run the in-process endpoint suite on a Mongo stand-in")
+    parser.add_argument("--batches", type=int, default=50, help="Suite dataset size")
+    parser.add_argument("--events", type=int, default=5, help="Suite events per seeded batch")
+    parser.add_argument("--requests", type=int, default=200, help="Suite requests per scenario")
+    parser.add_argument("--only", help="Comma-separated suite scenarios to run")
+    parser.add_argument("--save", help="Write suite results to this JSON baseline")
+    parser.add_argument("--compare", help="Compare suite results with this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95/req/s regression fraction")
+    args = parser.parse_args()
+
+    if args.hashing:
+        return 0 if hashing_microbenchmark() else 1
+
+    if args.suite:
+        only = set(args.only.split(",")) if args.only else None
+        results = asyncio.run(load_suite(args.batches, args.events, args.requests, args.concurrency, only))
+        clean = all(result["errors"] == 0 for result in results.values())
+        if args.compare:
+            baseline = json.loads(Path(args.compare).read_text())
+            clean = compare_baseline(baseline, results, args.tolerance) and clean
+        if args.save:
+            Path(args.save).write_text(json.dumps({
+                "commit": git_commit(),
+                "created": datetime.now(timezone.utc).isoformat(),
+                "parameters": {
+                    "batches": args.batches, "events": args.events,
+                    "requests": args.requests, "concurrency": args.concurrency
+                },
+                "scenarios": results
+            }, indent=2))
+            print(f"💾 Baseline written to {args.save}")
+        return 0 if clean else 1
+
+    benchmark = HerbTraceabilityBenchmark(args.base_url)
+    if args.ingest:
+        print(f"🌐 Benchmarking against: {benchmark.base_url}")
+        return 0 if benchmark.ingest_latency(args.appends, args.concurrency) else 1
+    print(f"🌐 Benchmarking against: {benchmark.base_url}")
+    print("=" * 60)
+    single_ok = benchmark.stress_single_batch(args.appends, args.concurrency)
+    many_ok = benchmark.stress_many_batches(args.appends, args.concurrency)
+    print("=" * 60)
+    print(f"📊 Single batch chain intact: {single_ok}, multi-batch run clean: {many_ok}")
+    return 0 if single_ok and many_ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
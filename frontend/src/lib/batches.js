@@ -0,0 +1,20 @@
+import axios from 'axios';
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+const PAGE_SIZE = 1000;
+
+// /api/batches returns one page at a time, newest first, with the next page's
+// cursor in X-Next-Cursor. Follow it to the end and return the batches oldest
+// first, the order the pages have always relied on.
+export async function fetchAllBatches() {
+  const batches = [];
+  let cursor = null;
+  do {
+    const params = cursor ? { limit: PAGE_SIZE, cursor } : { limit: PAGE_SIZE };
+    const response = await axios.get(`${API}/batches`, { params });
+    batches.push(...response.data);
+    cursor = response.headers['x-next-cursor'];
+  } while (cursor);
+  return batches.reverse();
+}
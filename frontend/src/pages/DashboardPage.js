@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom';
 import axios from 'axios';
+import { fetchAllBatches } from '@/lib/batches';
 import { QRCodeSVG } from 'qrcode.react';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -24,14 +25,13 @@ const DashboardPage = () => {
 
   const fetchData = async () => {
     try {
-      const response = await axios.get(`${API}/batches`);
-      const batchData = response.data;
+      const batchData = await fetchAllBatches();
       setBatches(batchData);
       
       // Calculate statistics
       const totalQuantity = batchData.reduce((sum, batch) => sum + batch.total_quantity_kg, 0);
       const testedBatches = batchData.filter(batch => 
-        batch.blockchain_events.length >= 3 || batch.current_status === 'tested'
+        batch.event_count >= 3 || batch.current_status === 'tested'
       ).length;
       
       setStats({
@@ -216,7 +216,7 @@ const DashboardPage = () => {
                             {batch.current_status}
                           </div>
                           <div className="text-xs" style={{color: 'var(--text-muted)'}}>
-                            {batch.blockchain_events.length} events
+                            {batch.event_count} events
                           </div>
                         </div>
                       </div>
@@ -265,7 +265,7 @@ const DashboardPage = () => {
                       
                       <div>
                         <span className="font-medium">Blockchain Events:</span>
-                        <p>{selectedBatch.blockchain_events.length} recorded</p>
+                        <p>{selectedBatch.event_count} recorded</p>
                       </div>
                     </div>
                   </div>
@@ -422,7 +422,7 @@ const DashboardPage = () => {
               {batches.length > 0 ? (
                 <>
                   <p>Latest collection: {formatDate(batches[batches.length - 1]?.created_date)}</p>
-                  <p>Total events: {batches.reduce((sum, b) => sum + b.blockchain_events.length, 0)}</p>
+                  <p>Total events: {batches.reduce((sum, b) => sum + b.event_count, 0)}</p>
                   <p>Active tracking: {batches.length} batches</p>
                 </>
               ) : (
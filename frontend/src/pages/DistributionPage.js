@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { Link, useSearchParams } from 'react-router-dom';
 import axios from 'axios';
+import { fetchAllBatches } from '@/lib/batches';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -37,8 +38,7 @@ const DistributionPage = () => {
 
   const fetchBatches = async () => {
     try {
-      const response = await axios.get(`${API}/batches`);
-      setBatches(response.data);
+      setBatches(await fetchAllBatches());
     } catch (error) {
       console.error('Error fetching batches:', error);
     }
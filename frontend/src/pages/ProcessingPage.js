@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
+import { fetchAllBatches } from '@/lib/batches';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -28,8 +29,7 @@ const ProcessingPage = () => {
 
   const fetchBatches = async () => {
     try {
-      const response = await axios.get(`${API}/batches`);
-      setBatches(response.data);
+      setBatches(await fetchAllBatches());
     } catch (error) {
       console.error('Error fetching batches:', error);
     }
@@ -152,7 +152,7 @@ const ProcessingPage = () => {
                   <div><span className="font-medium">Origin:</span> 
                     {selectedBatch.origin_location.district || 'Auto-detected'}
                   </div>
-                  <div><span className="font-medium">Events:</span> {selectedBatch.blockchain_events.length}</div>
+                  <div><span className="font-medium">Events:</span> {selectedBatch.event_count}</div>
                 </div>
               </div>
             )}
@@ -0,0 +1,68 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# server.py reads its settings at import; point it at a throwaway database name
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "herb_traceability_test")
+os.environ.setdefault("MERKLE_ANCHOR_INTERVAL_SECONDS", "0")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+import server as server_module  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def server(monkeypatch, tmp_path):
+    """server.py backed by a fresh in-memory database (mongomock-motor)"""
+    from mongomock_motor import AsyncMongoMockClient
+
+    client = AsyncMongoMockClient()
+    monkeypatch.setattr(server_module, "client", client)
+    monkeypatch.setattr(server_module, "db", client[os.environ["DB_NAME"]])
+    monkeypatch.setattr(server_module.qr_cache, "directory", tmp_path / "qr_cache")
+    await server_module.ensure_indexes()
+    return server_module
+
+
+@pytest.fixture
+async def api(server):
+    """HTTP client calling the app in-process"""
+    import httpx
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+def create_batch(api):
+    """Create a batch through POST /api/collection and return its id"""
+    async def create():
+        response = await api.post("/api/collection", json={
+            "herb_type": "ashwagandha",
+            "quantity_kg": 25.5,
+            "location": {"latitude": 15.3, "longitude": 75.7, "district": "Ballari", "state": "Karnataka"},
+            "collector_name": "Test Collector",
+        })
+        assert response.status_code == 200, response.text
+        return response.json()["id"]
+    return create
+
+
+@pytest.fixture
+def add_processing(api):
+    """Append a processing event to a batch and return the response body"""
+    async def add(batch_id, processor_name="Test Processor"):
+        response = await api.post("/api/processing", json={
+            "batch_id": batch_id, "processing_type": "drying", "processor_name": processor_name
+        })
+        assert response.status_code == 200, response.text
+        return response.json()
+    return add
@@ -0,0 +1,69 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def insert_legacy_batch(server, batch_id, length):
+    """A batch in the pre-summary layout: block ids in a blockchain_events array"""
+    previous_hash, block_number, block_ids = "genesis", 0, []
+    for i in range(length):
+        event = server.build_blockchain_event(
+            batch_id, server.EventType.PROCESSING, {"id": f"{batch_id}-{i}", "processor_name": f"P{i}"},
+            previous_hash, block_number
+        )
+        await server.db.blockchain_events.insert_one(server.block_document(event))
+        previous_hash, block_number = event.hash, event.block_number
+        block_ids.append(event.id)
+    await server.db.herb_batches.insert_one({
+        "id": batch_id, "batch_number": f"HB-{batch_id}", "current_status": "collected",
+        "blockchain_events": block_ids
+    })
+    return previous_hash
+
+
+async def test_migration_stores_the_last_block_summary(server):
+    tail_hash = await insert_legacy_batch(server, "b1", 3)
+
+    assert await server.migrate_batch_summaries() == 1
+    batch = await server.db.herb_batches.find_one({"id": "b1"})
+    assert "blockchain_events" not in batch
+    assert batch["event_count"] == 3
+    assert batch["last_block_number"] == 3
+    assert batch["tail_hash"] == tail_hash
+    assert batch["last_event_type"] == "processing"
+
+
+async def test_batch_without_blocks_gets_an_empty_summary(server):
+    await insert_legacy_batch(server, "empty", 0)
+
+    await server.migrate_batch_summaries()
+    batch = await server.db.herb_batches.find_one({"id": "empty"})
+    assert batch["event_count"] == 0 and batch["tail_hash"] == "genesis"
+
+
+async def test_rerun_is_a_no_op_and_keeps_newer_summaries(server, monkeypatch):
+    monkeypatch.setattr(server, "SUMMARY_MIGRATION_BATCH", 2)
+    for i in range(5):
+        await insert_legacy_batch(server, f"b{i}", i + 1)
+
+    assert await server.migrate_batch_summaries() == 5
+
+    # A block appended after the migration moves the summary forward
+    tail = await server.db.blockchain_events.find_one({"batch_id": "b0"}, sort=[("block_number", -1)])
+    event = server.build_blockchain_event("b0", server.EventType.TESTING, {"id": "late"}, tail["hash"], tail["block_number"])
+    await server.db.blockchain_events.insert_one(server.block_document(event))
+    await server.write_batch_summaries({"b0": [event]})
+    before = await server.db.herb_batches.find({}, {"_id": 0}).sort("id", 1).to_list(None)
+
+    assert await server.migrate_batch_summaries() == 0
+    assert await server.db.herb_batches.find({}, {"_id": 0}).sort("id", 1).to_list(None) == before
+    assert before[0]["event_count"] == 2 and before[0]["tail_hash"] == event.hash
+
+
+async def test_interrupted_migration_finishes_on_rerun(server):
+    await insert_legacy_batch(server, "done", 2)
+    await server.migrate_batch_summaries()
+    await insert_legacy_batch(server, "pending", 2)
+
+    assert await server.migrate_batch_summaries() == 1
+    assert await server.db.herb_batches.count_documents({"blockchain_events": {"$exists": True}}) == 0
@@ -0,0 +1,43 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("path", [
+    "/api/batch/no-such-batch/provenance",
+    "/api/export/batch/no-such-batch/json",
+    "/api/qr/no-such-batch/base64",
+    "/api/export/batch/no-such-batch/pdf",
+])
+async def test_batch_views_404_for_unknown_batch(api, path):
+    response = await api.get(path)
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Batch not found"
+
+
+async def test_provenance_for_existing_batch(api, create_batch, add_processing):
+    batch_id = await create_batch()
+    await add_processing(batch_id)
+
+    response = await api.get(f"/api/batch/{batch_id}/provenance")
+
+    assert response.status_code == 200
+    assert response.json()["total_events"] == 2
+
+
+async def test_qr_image_revalidation(server, api, create_batch):
+    batch_id = await create_batch()
+    response = await api.get(f"/api/qr/{batch_id}/image")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    response = await api.get(f"/api/qr/{batch_id}/image", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # A matching ETag for a batch that does not exist must not be confirmed
+    unknown_etag = f'"{server.qr_cache.key(server.qr_scan_url("no-such-batch"))}"'
+    response = await api.get("/api/qr/no-such-batch/image", headers={"If-None-Match": unknown_etag})
+    assert response.status_code == 404
+    response = await api.get("/api/qr/no-such-batch/image")
+    assert response.status_code == 404
@@ -0,0 +1,141 @@
+import copy
+
+import pytest
+
+import server
+
+
+def build_chain(length, batch_id="batch-1"):
+    """Blocks as stored, linked and hashed the way the write path does it"""
+    blocks = []
+    previous_hash, block_number = "genesis", 0
+    for i in range(length):
+        event = server.build_blockchain_event(
+            batch_id, server.EventType.PROCESSING, {"id": f"event-{i}", "processor_name": f"P{i}"},
+            previous_hash, block_number
+        )
+        blocks.append(server.block_document(event))
+        previous_hash, block_number = event.hash, event.block_number
+    return blocks
+
+
+def verify(blocks):
+    return server.verify_chain_blocks(blocks)
+
+
+def test_intact_chain_verifies():
+    report = verify(build_chain(5))
+
+    assert report == {"verified": True, "first_invalid_block": None, "reason": None, "blocks_checked": 5}
+
+
+def test_empty_chain_verifies():
+    assert verify([])["verified"]
+
+
+def test_tampered_event_data_is_caught_at_that_block():
+    blocks = build_chain(5)
+    blocks[2]["event_data"]["processor_name"] = "Someone else"
+
+    report = verify(blocks)
+    assert not report["verified"]
+    assert report["first_invalid_block"] == 3
+    assert report["reason"] == "stored hash does not match the block contents"
+
+
+def test_tampered_timestamp_is_caught():
+    blocks = build_chain(3)
+    blocks[1]["timestamp"] = "2020-01-01T00:00:00+00:00"
+
+    assert verify(blocks)["first_invalid_block"] == 2
+
+
+def test_rehashed_block_breaks_the_next_link():
+    # Recomputing the tampered block's hash just moves the failure to its successor
+    blocks = build_chain(4)
+    blocks[1]["event_data"]["processor_name"] = "Someone else"
+    blocks[1]["hash"] = server.hash_blocks([blocks[1]])[0]
+
+    report = verify(blocks)
+    assert report["first_invalid_block"] == 3
+    assert report["reason"] == "previous_hash does not match the prior block"
+
+
+def test_renumbered_blocks_are_caught():
+    blocks = build_chain(4)
+    blocks[2]["block_number"] = 7
+
+    report = verify(blocks)
+    assert report["first_invalid_block"] == 7
+    assert report["reason"] == "expected block number 3"
+    assert report["blocks_checked"] == 3
+
+
+def test_missing_block_is_caught():
+    blocks = build_chain(4)
+    del blocks[1]
+
+    report = verify(blocks)
+    assert report["first_invalid_block"] == 3
+    assert report["reason"] == "expected block number 2"
+
+
+def test_relinked_block_is_caught():
+    # A block re-pointed at an older block, with its own hash recomputed to match
+    blocks = build_chain(4)
+    blocks[2]["previous_hash"] = blocks[0]["hash"]
+    blocks[2]["hash"] = server.hash_blocks([blocks[2]])[0]
+
+    report = verify(blocks)
+    assert report["first_invalid_block"] == 3
+    assert report["reason"] == "previous_hash does not match the prior block"
+
+
+def test_first_block_must_start_from_genesis():
+    blocks = build_chain(2)
+    blocks[0]["previous_hash"] = "0" * 64
+    blocks[0]["hash"] = server.hash_blocks([blocks[0]])[0]
+
+    assert verify(blocks)["first_invalid_block"] == 1
+
+
+def test_verification_does_not_modify_blocks():
+    blocks = build_chain(3)
+    snapshot = copy.deepcopy(blocks)
+    verify(blocks)
+
+    assert blocks == snapshot
+
+
+@pytest.mark.anyio
+async def test_verify_endpoint(server, api, create_batch, add_processing):
+    batch_id = await create_batch()
+    await add_processing(batch_id)
+
+    response = await api.get(f"/api/batch/{batch_id}/verify")
+    assert response.status_code == 200
+    assert response.json()["verified"]
+
+    await server.db.blockchain_events.update_one(
+        {"batch_id": batch_id, "block_number": 2}, {"$set": {"event_data.processor_name": "Forged"}}
+    )
+    # Cached reports are keyed by the tail, which this edit leaves alone
+    server.verification_cache.pop(batch_id)
+    response = await api.get(f"/api/batch/{batch_id}/verify")
+    assert response.json()["first_invalid_block"] == 2
+
+
+@pytest.mark.anyio
+async def test_verify_endpoint_404s_for_unknown_batch(api):
+    response = await api.get("/api/batch/no-such-batch/verify")
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Batch not found"
+
+
+@pytest.mark.anyio
+async def test_resuming_an_unknown_audit_404s(api):
+    response = await api.post("/api/audit", params={"resume_job_id": "no-such-job"})
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Audit job not found"
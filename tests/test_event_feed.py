@@ -0,0 +1,16 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_feed_subscribes_only_while_streaming(server):
+    response = await server.stream_events(batch_id=None, herb_type=None, status=None)
+    # A client that disconnects before the body starts leaves nothing behind
+    assert server.event_feed.subscriber_count() == 0
+
+    frames = response.body_iterator
+    assert await frames.__anext__() == "retry: 3000\n\n"
+    assert server.event_feed.subscriber_count() == 1
+
+    await frames.aclose()
+    assert server.event_feed.subscriber_count() == 0
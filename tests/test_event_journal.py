@@ -0,0 +1,165 @@
+import asyncio
+import json
+import shutil
+import time
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def journal(server, monkeypatch, tmp_path):
+    """Run the app in INGEST_MODE=journal with a journal under tmp_path"""
+    journal = server.EventJournal(tmp_path / "events.jsonl", fsync=False)
+    journal.open()
+    monkeypatch.setattr(server, "INGEST_MODE", "journal")
+    monkeypatch.setattr(server, "event_journal", journal)
+    yield journal
+    journal.close()
+
+
+def reopen(server, monkeypatch, journal):
+    """Simulate a restart: drop in-memory state and open the same files again"""
+    journal.close()
+    reopened = server.EventJournal(journal.path, fsync=False)
+    reopened.open()
+    monkeypatch.setattr(server, "event_journal", reopened)
+    return reopened
+
+
+async def drain(journal):
+    while await journal.flush():
+        pass
+
+
+async def stored_chain(server, batch_id):
+    blocks = await server.db.blockchain_events.find({"batch_id": batch_id}, {"_id": 0}).sort("block_number", 1).to_list(None)
+    return blocks, await server.verify_chain(batch_id, blocks)
+
+
+async def test_writes_are_journaled_before_reaching_mongo(server, journal, create_batch, add_processing):
+    batch_id = await create_batch()
+    await add_processing(batch_id)
+
+    assert journal.stats()["pending"] == 2
+    assert await server.db.blockchain_events.count_documents({}) == 0
+    assert len(journal.path.read_bytes().splitlines()) == 2
+
+
+async def test_replay_after_reopen_flushes_in_chain_order(server, journal, monkeypatch, create_batch, add_processing):
+    batch_id = await create_batch()
+    for i in range(3):
+        await add_processing(batch_id, f"Processor {i}")
+
+    journal = reopen(server, monkeypatch, journal)
+    assert journal.stats()["pending"] == 4
+    await drain(journal)
+
+    blocks, report = await stored_chain(server, batch_id)
+    assert [block["block_number"] for block in blocks] == [1, 2, 3, 4]
+    assert [block["event_data"].get("processor_name") for block in blocks[1:]] == ["Processor 0", "Processor 1", "Processor 2"]
+    assert report["verified"]
+    batch = await server.db.herb_batches.find_one({"id": batch_id})
+    assert batch["event_count"] == 4 and batch["tail_hash"] == blocks[-1]["hash"]
+
+
+async def test_replaying_flushed_records_is_idempotent(server, journal, monkeypatch, create_batch, add_processing):
+    batch_id = await create_batch()
+    await add_processing(batch_id)
+    saved = journal.path.with_name("saved.jsonl")
+    shutil.copy(journal.path, saved)
+    await drain(journal)
+
+    # Crash after writing to Mongo but before the checkpoint moved
+    journal.close()
+    shutil.copy(saved, journal.path)
+    journal.checkpoint_path.unlink()
+    journal = reopen(server, monkeypatch, journal)
+    assert journal.stats()["pending"] == 2
+    await drain(journal)
+
+    blocks, report = await stored_chain(server, batch_id)
+    assert len(blocks) == 2 and report["verified"]
+    assert await server.db.herb_batches.count_documents({"id": batch_id}) == 1
+    assert await server.db.processing_events.count_documents({}) == 1
+
+
+async def test_torn_final_line_is_dropped(server, journal, monkeypatch, create_batch, add_processing):
+    batch_id = await create_batch()
+    await add_processing(batch_id)
+    valid_size = journal.path.stat().st_size
+    journal.close()
+    with open(journal.path, "ab") as file:
+        file.write(b'{"seq": 3, "block": {"batch_')
+
+    journal = reopen(server, monkeypatch, journal)
+    assert journal.stats()["pending"] == 2
+    assert journal.path.stat().st_size == valid_size
+
+    # New records start on a clean line and survive another restart
+    await add_processing(batch_id, "After restart")
+    journal = reopen(server, monkeypatch, journal)
+    assert [json.loads(line)["seq"] for line in journal.path.read_bytes().splitlines()] == [1, 2, 3]
+    await drain(journal)
+    blocks, report = await stored_chain(server, batch_id)
+    assert len(blocks) == 3 and report["verified"]
+
+
+async def test_journal_is_truncated_after_a_full_flush(server, journal, create_batch, add_processing):
+    batch_id = await create_batch()
+    await add_processing(batch_id)
+    await drain(journal)
+
+    assert journal.path.stat().st_size == 0
+    assert journal.checkpoint_path.read_text() == "2"
+    assert journal.stats()["pending"] == 0
+
+    # Sequence numbers keep counting after truncation
+    await add_processing(batch_id)
+    assert json.loads(journal.path.read_bytes().splitlines()[0])["seq"] == 3
+
+
+async def test_unflushed_batches_exist_and_carry_their_status(server, journal, api, create_batch):
+    batch_id = await create_batch()
+    packaging = {
+        "batch_id": batch_id, "packaging_type": "bottling", "packager_name": "Packer",
+        "quantity_packages": 10, "package_size": "100g"
+    }
+
+    # The batch is only in the journal, yet stage writes find it
+    for _ in range(2):
+        response = await api.post("/api/packaging", json=packaging)
+        assert response.status_code == 200, response.text
+    assert journal.pending_statuses([batch_id]) == {batch_id: "packaged"}
+    missing = await api.post("/api/packaging", json={**packaging, "batch_id": "no-such-batch"})
+    assert missing.status_code != 200
+
+    await drain(journal)
+    batch = await server.db.herb_batches.find_one({"id": batch_id})
+    assert batch["current_status"] == "packaged"
+    stats = await server.db.platform_stats.find_one({"_id": server.STATS_ID})
+    assert stats["status"] == {"collected": 0, "packaged": 1}
+    assert stats["total_events"] == 3
+
+
+async def test_concurrent_appends_share_a_write(server, journal, monkeypatch, create_batch, add_processing):
+    batch_ids = [await create_batch() for _ in range(5)]
+    writes = []
+    write = journal._write
+
+    def slow_write(data):
+        # Keep the first write in flight while the other appends queue up
+        writes.append(data.count(b"\n"))
+        time.sleep(0.05)
+        write(data)
+
+    monkeypatch.setattr(journal, "_write", slow_write)
+    await asyncio.gather(*(add_processing(batch_id) for batch_id in batch_ids))
+
+    assert sum(writes) == 5 and len(writes) < 5
+    assert journal.stats()["pending"] == 10
+    await drain(journal)
+    for batch_id in batch_ids:
+        blocks, report = await stored_chain(server, batch_id)
+        assert len(blocks) == 2 and report["verified"]
@@ -0,0 +1,97 @@
+import hashlib
+
+import pytest
+
+import server
+
+
+def block_hashes(count):
+    return [hashlib.sha256(str(i).encode()).hexdigest() for i in range(count)]
+
+
+@pytest.mark.parametrize("leaf_count", [1, 2, 3, 5, 4096])
+def test_every_leaf_proves_against_the_root(leaf_count):
+    hashes = block_hashes(leaf_count)
+    levels = server.merkle_levels(hashes)
+    root = levels[-1][0].hex()
+
+    assert len(levels[-1]) == 1
+    for index in sorted({0, 1, leaf_count // 2, leaf_count - 2, leaf_count - 1} & set(range(leaf_count))):
+        proof = server.merkle_proof(levels, index)
+        assert server.verify_merkle_proof(hashes[index], proof, root)
+
+
+def test_single_leaf_root_is_the_leaf_hash():
+    hashes = block_hashes(1)
+    levels = server.merkle_levels(hashes)
+
+    assert levels[-1][0] == server.merkle_leaf(hashes[0])
+    assert server.merkle_proof(levels, 0) == []
+
+
+def test_odd_last_node_is_paired_with_itself():
+    hashes = block_hashes(3)
+    levels = server.merkle_levels(hashes)
+    leaves = levels[0]
+
+    assert levels[1][1] == server.merkle_node(leaves[2], leaves[2])
+    proof = server.merkle_proof(levels, 2)
+    assert proof[0] == {"position": "right", "hash": leaves[2].hex()}
+    assert server.verify_merkle_proof(hashes[2], proof, levels[-1][0].hex())
+
+
+def test_proof_length_is_tree_height():
+    levels = server.merkle_levels(block_hashes(4096))
+
+    assert len(levels) == 13
+    assert len(server.merkle_proof(levels, 4095)) == 12
+
+
+def test_proof_rejects_other_leaves_and_tampered_siblings():
+    hashes = block_hashes(5)
+    levels = server.merkle_levels(hashes)
+    root = levels[-1][0].hex()
+    proof = server.merkle_proof(levels, 3)
+
+    assert not server.verify_merkle_proof(hashes[2], proof, root)
+    tampered = [dict(step) for step in proof]
+    tampered[1]["hash"] = "00" * 32
+    assert not server.verify_merkle_proof(hashes[3], tampered, root)
+    swapped = [dict(step, position="left" if step["position"] == "right" else "right") for step in proof]
+    assert not server.verify_merkle_proof(hashes[3], swapped, root)
+
+
+def test_inner_node_is_not_accepted_as_a_leaf():
+    # Leaves and nodes hash with different prefixes, so an inner node cannot be
+    # passed off as a block hash with a shortened proof
+    levels = server.merkle_levels(block_hashes(4))
+    root = levels[-1][0].hex()
+    forged_proof = [{"position": "right", "hash": levels[1][1].hex()}]
+
+    assert not server.verify_merkle_proof(levels[1][0].hex(), forged_proof, root)
+
+
+@pytest.mark.anyio
+async def test_proof_endpoint_returns_a_verifiable_proof(server, api, create_batch, add_processing):
+    batch_id = await create_batch()
+    event = await add_processing(batch_id)
+
+    assert (await api.post("/api/anchors")).status_code == 200
+    response = await api.get(f"/api/proof/{event['event_id']}")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["batch_id"] == batch_id
+    assert server.verify_merkle_proof(body["block_hash"], body["proof"], body["anchor"]["root"])
+
+
+@pytest.mark.anyio
+async def test_proof_endpoint_404s(api, create_batch, add_processing):
+    missing = await api.get("/api/proof/no-such-event")
+    assert missing.status_code == 404
+    assert missing.json()["detail"] == "Event not found"
+
+    event = await add_processing(await create_batch())
+    unanchored = await api.get(f"/api/proof/{event['event_id']}")
+    assert unanchored.status_code == 404
+    assert unanchored.json()["detail"] == "Event not anchored yet"
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_status_changes_count_the_batch_once(server, api, create_batch, monkeypatch):
+    batch_id = await create_batch()
+    append = server.append_blockchain_events
+
+    async def slow_append(*args, **kwargs):
+        # Let every request read the batch before any of them writes
+        await asyncio.sleep(0.01)
+        return await append(*args, **kwargs)
+
+    monkeypatch.setattr(server, "append_blockchain_events", slow_append)
+    responses = await asyncio.gather(*(api.post("/api/packaging", json={
+        "batch_id": batch_id, "packaging_type": "bottling", "packager_name": f"Packer {i}",
+        "quantity_packages": 10, "package_size": "100g"
+    }) for i in range(3)))
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    stats = await server.db.platform_stats.find_one({"_id": server.STATS_ID})
+    assert stats["status"] == {"collected": 0, "packaged": 1}
+    assert (await server.db.herb_batches.find_one({"id": batch_id}))["current_status"] == "packaged"
+
+
+async def test_stage_event_for_unknown_batch_is_not_found(api):
+    response = await api.post("/api/processing", json={
+        "batch_id": "no-such-batch", "processing_type": "drying", "processor_name": "P"
+    })
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Batch not found"
+
+
+async def test_bulk_events_report_missing_batches_per_item(api, create_batch):
+    batch_id = await create_batch()
+    response = await api.post("/api/events/bulk", json={"events": [
+        {"event_type": "processing", "data": {"batch_id": batch_id, "processing_type": "drying", "processor_name": "P"}},
+        {"event_type": "processing", "data": {"batch_id": "no-such-batch", "processing_type": "drying", "processor_name": "P"}},
+    ]})
+
+    body = response.json()
+    assert body["created"] == 1
+    assert body["results"][0]["block_number"] == 2
+    assert body["results"][1]["error"] == "Batch not found"
+
+
+async def test_bulk_collection_items_create_batches(server, api):
+    response = await api.post("/api/events/bulk", json={"events": [
+        {"event_type": "collection", "event_date": "2024-03-01T06:30:00Z", "data": {
+            "herb_type": "tulsi", "quantity_kg": 4.0, "collector_name": "C",
+            "location": {"latitude": 12.9, "longitude": 77.6, "district": "Bengaluru", "state": "Karnataka"},
+        }},
+        {"event_type": "collection", "data": {"herb_type": "tulsi", "collector_name": "C"}},
+    ]})
+
+    body = response.json()
+    assert body["created"] == 1
+    created, invalid = body["results"]
+    assert created["block_number"] == 1
+    assert invalid["status"] == "error" and "quantity_kg" in invalid["error"]
+
+    provenance = (await api.get(f"/api/batch/{created['batch_id']}/provenance")).json()
+    assert provenance["batch"]["herb_type"] == "tulsi"
+    assert provenance["provenance_chain"][0]["event_type"] == "collection"
+    assert provenance["provenance_chain"][0]["event_data"]["collection_date"].startswith("2024-03-01T06:30:00")
+
+
+async def test_stage_collections_can_be_skipped(server, monkeypatch, create_batch, add_processing):
+    monkeypatch.setattr(server, "WRITE_STAGE_COLLECTIONS", False)
+    batch_id = await create_batch()
+    await add_processing(batch_id)
+
+    assert await server.db.collection_events.count_documents({}) == 0
+    assert await server.db.processing_events.count_documents({}) == 0
+    # The chain and the batch summary are still written
+    batch = await server.db.herb_batches.find_one({"id": batch_id})
+    assert batch["event_count"] == 2 and batch["last_event_type"] == "processing"